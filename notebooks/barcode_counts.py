@@ -0,0 +1,154 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from binned_stats import binned_statistics
+from mpra_io import read_table
+
+class BarcodeCounts(object):
+    """
+    Barcode resolution DNA and RNA counts for one experiment.
+
+    Parameters
+    ----------
+    keys : array of str
+        element keys, one per row.
+    dna : np.array
+        (elements, barcodes, replicates) plasmid counts. A single replicate is
+        shared by every RNA replicate; otherwise replicates are paired.
+    rna : np.array
+        (elements, barcodes, replicates) mRNA counts.
+    min_dna_count : int
+        barcodes with fewer plasmid reads are ignored. Default: 20.
+    """
+
+    def __init__(self, keys, dna, rna, min_dna_count=20):
+        assert dna.shape[:2] == rna.shape[:2] and dna.shape[2] in (1, rna.shape[2])
+        self.keys = np.asarray(keys)
+        self.dna = np.asarray(dna, dtype=np.float64)
+        self.rna = np.asarray(rna, dtype=np.float64)
+        self.min_dna_count = min_dna_count
+        self.offsets = self._library_offsets()
+
+    @classmethod
+    def from_files(cls, dna_files, rna_files, **kwargs):
+        """
+        Reads *.counts files (header line, then key and one column per barcode).
+        """
+        keys = None
+        tensors = []
+        for files in (dna_files, rna_files):
+            replicates = []
+            for count_file in files:
+                file_keys, counts = read_table(count_file, header=True)
+                assert keys is None or (file_keys == keys).all()
+                keys = file_keys
+                replicates.append(counts)
+            tensors.append(np.stack(replicates, axis=-1))
+        return cls(keys, *tensors, **kwargs)
+
+    @classmethod
+    def concatenate(cls, barcode_counts):
+        """
+        Stacks the elements of several BarcodeCounts (e.g. one per design), keeping
+        each one's library normalization.
+        """
+        result = cls.__new__(cls)
+        result.min_dna_count = barcode_counts[0].min_dna_count
+        for attribute in ('keys', 'dna', 'rna', 'offsets'):
+            setattr(result, attribute, np.concatenate(
+                [getattr(counts, attribute) for counts in barcode_counts]))
+        return result
+
+    def valid(self):
+        """
+        Returns the (elements, barcodes, replicates) mask of usable measurements.
+        """
+        return np.broadcast_to(self.dna >= self.min_dna_count, self.rna.shape)
+
+    def log_ratios(self):
+        """
+        Returns library normalized log2((rna + 1) / (dna + 1)) per barcode and replicate.
+        """
+        return (np.log2(self.rna + 1) - np.log2(self.dna + 1) +
+                self.offsets[:, np.newaxis, :])
+
+    def activity(self):
+        """
+        Returns the mean log ratio over the valid barcodes and replicates of each
+        element, 0 for elements without any.
+        """
+        valid = self.valid()
+        num_valid = valid.sum(axis=(1, 2))
+        total = np.where(valid, self.log_ratios(), 0).sum(axis=(1, 2))
+        return np.where(num_valid > 0, total / np.maximum(num_valid, 1), 0)
+
+    def variance(self, prior_df=4, quantiles=None):
+        """
+        Returns the variance of each element's activity estimate.
+
+        The spread of its barcode / replicate log ratios is shrunk towards a prior
+        variance with prior_df pseudo degrees of freedom, so elements with one or
+        two measurements still get a usable estimate. The prior is the pooled
+        variance, or with quantiles set, the variance_vs_dna trend at the
+        element's plasmid count. Elements without any valid measurement are inf.
+        """
+        values, valid = self.log_ratios(), self.valid()
+        prior_variance = None
+        if quantiles is not None:
+            trend = self.variance_vs_dna(quantiles)
+            known = np.isfinite(trend['mean'])
+            prior_variance = np.interp(self._total_dna(), trend['x'][known], trend['mean'][known])
+        return dispersion_variance(values, valid, prior_df, prior_variance)
+
+    def variance_vs_dna(self, quantiles=100):
+        """
+        Returns binned_statistics of the per element sample variance of the log
+        ratios against total plasmid count, weighted by degrees of freedom.
+        """
+        _, df, variance = sample_variance(self.log_ratios(), self.valid())
+        with np.errstate(invalid='ignore'):
+            return binned_statistics(self._total_dna(), variance, quantiles, weights=df)
+
+    def weights(self, prior_df=4, quantiles=None):
+        """
+        Returns inverse variance training weights, 0 for unmeasured elements.
+        """
+        return 1 / self.variance(prior_df, quantiles)
+
+    def _total_dna(self):
+        return self.dna.sum(axis=(1, 2))
+
+    def _library_offsets(self):
+        # log2(total DNA) - log2(total RNA) over valid barcodes, per replicate,
+        # as in load_data.normalized_scores.
+        valid = self.valid()
+        dna = np.broadcast_to(self.dna, self.rna.shape)
+        total_dna = np.where(valid, dna + 1, 0).sum(axis=(0, 1))
+        total_rna = np.where(valid, self.rna + 1, 0).sum(axis=(0, 1))
+        offsets = np.log2(np.maximum(total_dna, 1)) - np.log2(np.maximum(total_rna, 1))
+        return np.tile(offsets, (len(self.keys), 1))
+
+def sample_variance(values, valid):
+    """
+    Returns (num_valid, degrees of freedom, sample variance) of each row of values
+    over its valid entries. values and valid are (elements, ...) arrays; every
+    axis but the first is reduced.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+    valid = np.asarray(valid, dtype=bool).reshape(len(values), -1)
+    num_valid = valid.sum(axis=1)
+    mean = np.where(valid, values, 0).sum(axis=1) / np.maximum(num_valid, 1)
+    squares = np.where(valid, (values - mean[:, np.newaxis]) ** 2, 0).sum(axis=1)
+    df = np.maximum(num_valid - 1, 0)
+    return num_valid, df, squares / np.maximum(df, 1)
+
+def dispersion_variance(values, valid, prior_df=4, prior_variance=None):
+    """
+    Returns the variance of the mean of each row of values over its valid entries,
+    with the sample variance shrunk towards prior_variance (a scalar or one value
+    per row; default: the pooled variance). Rows without valid entries are inf.
+    """
+    num_valid, df, variance = sample_variance(values, valid)
+    if prior_variance is None:
+        prior_variance = (df * variance).sum() / max(df.sum(), 1)
+    shrunk = (prior_df * prior_variance + df * variance) / np.maximum(prior_df + df, 1)
+    return np.where(num_valid > 0, shrunk / np.maximum(num_valid, 1), np.inf)
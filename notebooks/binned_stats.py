@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from collections import OrderedDict
+
+def quantile_bin_index(x, quantiles):
+    """
+    Returns (order, bin_starts): the argsort of x along the first axis and the
+    start offset of each of the quantiles equal count bins in that order.
+    """
+    x = np.asarray(x)
+    quantiles = max(min(quantiles, len(x)), 1)
+    order = np.argsort(x, axis=0, kind='mergesort')
+    bin_starts = np.arange(quantiles) * len(x) // quantiles
+    return order, bin_starts
+
+def binned_statistics(x, y, quantiles=100, weights=None):
+    """
+    Sorts elements by x, splits them into quantiles bins of (nearly) equal count
+    and reduces each bin.
+
+    Parameters
+    ----------
+    x : np.array
+        (N,) values to bin by, or (N, num_tasks) to bin each task separately.
+    y : np.array
+        (N,) or (N, num_tasks) values to summarize.
+    quantiles : int
+        number of bins. Default: 100.
+    weights : np.array, optional
+        (N,) or (N, num_tasks) weights for the mean and variance.
+
+    Returns
+    -------
+    OrderedDict of 'x' (mean x), 'count', 'mean', 'median' and 'variance', each a
+    (quantiles,) or (quantiles, num_tasks) array. The median is unweighted.
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    squeeze = x.ndim == 1 and y.ndim == 1
+    y = y.reshape(len(y), -1)
+    x = np.broadcast_to(x.reshape(len(x), -1), y.shape)
+    weights = np.ones_like(y) if weights is None else np.broadcast_to(
+        np.asarray(weights, dtype=np.float64).reshape(len(y), -1), y.shape)
+
+    order, bin_starts = quantile_bin_index(x, quantiles)
+    columns = np.arange(y.shape[1])
+    x, y, weights = x[order, columns], y[order, columns], weights[order, columns]
+
+    counts = np.diff(np.append(bin_starts, len(y)))
+    weight_sums = np.add.reduceat(weights, bin_starts)
+    x_mean = np.add.reduceat(x, bin_starts) / counts[:, np.newaxis]
+    mean = np.add.reduceat(weights * y, bin_starts) / weight_sums
+    deviations = y - np.repeat(mean, counts, axis=0)
+    variance = np.add.reduceat(weights * deviations ** 2, bin_starts) / weight_sums
+
+    # Sort y within each bin, then average the two middle elements.
+    bin_ids = np.repeat(np.arange(len(bin_starts)), counts)
+    within_bin = np.empty_like(y)
+    for column in columns:
+        within_bin[:, column] = y[np.lexsort((y[:, column], bin_ids)), column]
+    median = (within_bin[bin_starts + (counts - 1) // 2] + within_bin[bin_starts + counts // 2]) / 2
+
+    statistics = OrderedDict((
+        ('x', x_mean),
+        ('count', np.repeat(counts[:, np.newaxis], y.shape[1], axis=1)),
+        ('mean', mean),
+        ('median', median),
+        ('variance', variance),
+    ))
+    if squeeze:
+        statistics = OrderedDict((name, values[:, 0]) for name, values in statistics.items())
+    return statistics
+
+def quantile_plot(x, y, quantiles=5000, statistic='mean', weights=None, ax=None, **scatter_kwargs):
+    """
+    Scatters the per bin mean of x against the per bin statistic of y, one
+    series per task. Returns (x, statistic) like the notebooks' quantile_plot.
+    """
+    import matplotlib.pyplot as plt
+    statistics = binned_statistics(x, y, quantiles, weights)
+    ax = plt.gca() if ax is None else ax
+    xs, ys = statistics['x'], statistics[statistic]
+    for task_x, task_y in zip(xs.reshape(len(xs), -1).T, ys.reshape(len(ys), -1).T):
+        ax.scatter(task_x, task_y, **scatter_kwargs)
+    return statistics['x'], statistics[statistic]
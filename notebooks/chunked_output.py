@@ -0,0 +1,193 @@
+"""
+Chunked binary output of interpretation jobs; see ChunkedWriter.
+
+Usage: python chunked_output.py <output directory> [delimiter]
+       writes the records of a ChunkedWriter directory to stdout as text.
+"""
+from __future__ import absolute_import, division, print_function
+import glob, json, numpy as np, os, sys, threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+MANIFEST = 'manifest.json'
+
+class ChunkedWriter(object):
+    """
+    Append only output of fixed dtype records for interpretation jobs, replacing
+    one formatted text line per record.
+
+    Records are buffered into chunk_size record chunks (default: about 16 MB
+    of records); full chunks are saved by a
+    background thread as chunk_00000.npy, chunk_00001.npy, ... in the directory
+    path, so scoring continues while a chunk is written. manifest.json records the
+    dtype, the chunks written so far and, after close, complete = true, so a
+    reader can tell a finished job from one that is running or crashed.
+
+    Use as a context manager, or call close, to write the last partial chunk.
+
+    Parameters
+    ----------
+    dtype : list or np.dtype
+        record fields, e.g. [('chrom', 'S5'), ('start', 'i8'), ('scores', 'f4', (4, 145))].
+    attrs : dict, optional
+        JSON serializable metadata stored in the manifest, e.g. task names.
+    max_pending : int
+        number of full chunks that may wait to be written before append blocks.
+    """
+
+    def __init__(self, path, dtype, chunk_size=None, attrs=None, max_pending=2):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size or max(1, (1 << 24) // self.dtype.itemsize)
+        if os.path.isdir(path):
+            for fname in glob.glob(os.path.join(path, 'chunk_*.npy')) + [os.path.join(path, MANIFEST)]:
+                if os.path.exists(fname):
+                    os.remove(fname)
+        else:
+            os.makedirs(path)
+        self.manifest = {'dtype': self.dtype.descr, 'attrs': attrs or {}, 'chunks': [],
+                         'num_records': 0, 'complete': False}
+        self._write_manifest()
+        self._chunk = np.zeros(self.chunk_size, dtype=self.dtype)
+        self._size = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._flush_chunks)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, **columns):
+        """
+        Appends records given as one value or array per field; scalars are
+        broadcast, e.g. append(chrom='1', start=starts, scores=scores).
+        """
+        self._check_error()
+        missing = set(self.dtype.names) - set(columns)
+        if missing:
+            raise ValueError("Missing fields: {}".format(', '.join(sorted(missing))))
+        num_records = max(np.shape(columns[name])[0] if np.ndim(columns[name]) > len(self.dtype[name].shape)
+                          else 1 for name in self.dtype.names)
+        written = 0
+        while written < num_records:
+            size = min(num_records - written, self.chunk_size - self._size)
+            records = self._chunk[self._size:self._size + size]
+            for name in self.dtype.names:
+                value = columns[name]
+                records[name] = value[written:written + size] if \
+                    np.ndim(value) > len(self.dtype[name].shape) else value
+            self._size += size
+            written += size
+            if self._size == self.chunk_size:
+                self._queue_chunk()
+
+    def append_records(self, records):
+        """
+        Appends a structured array of self.dtype records.
+        """
+        self.append(**{name: records[name] for name in self.dtype.names})
+
+    def close(self):
+        if self._thread is None:
+            return
+        if self._size:
+            self._queue_chunk()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._check_error()
+        self.manifest['complete'] = True
+        self._write_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _queue_chunk(self):
+        # the writer thread owns the queued chunk, so continue in a new buffer
+        self._queue.put(self._chunk[:self._size])
+        self._chunk = np.zeros(self.chunk_size, dtype=self.dtype)
+        self._size = 0
+
+    def _flush_chunks(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                fname = 'chunk_{:05d}.npy'.format(len(self.manifest['chunks']))
+                np.save(os.path.join(self.path, fname), chunk)
+                self.manifest['chunks'].append({'fname': fname, 'num_records': len(chunk)})
+                self.manifest['num_records'] += len(chunk)
+                self._write_manifest()
+            except Exception as e:
+                self._error = e
+
+    def _check_error(self):
+        if self._error is not None:
+            raise IOError("Writing {} failed: {}".format(self.path, self._error))
+
+    def _write_manifest(self):
+        tmp_fname = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(tmp_fname, 'w') as f:
+            json.dump(self.manifest, f)
+        os.rename(tmp_fname, os.path.join(self.path, MANIFEST))
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+def iter_chunks(path, mmap_mode='r'):
+    """
+    Yields the record chunks of a ChunkedWriter directory, memory mapped by default.
+    """
+    for chunk in read_manifest(path)['chunks']:
+        yield np.load(os.path.join(path, chunk['fname']), mmap_mode=mmap_mode)
+
+def load_chunks(paths, require_complete=False):
+    """
+    Returns the records of one or more ChunkedWriter directories (e.g. the outputs
+    of the workers of one job) as a single structured array.
+    """
+    if isinstance(paths, string_types):
+        paths = [paths]
+    chunks = []
+    for path in paths:
+        if require_complete and not read_manifest(path)['complete']:
+            raise ValueError("{} is incomplete".format(path))
+        chunks.extend(iter_chunks(path))
+    if not chunks:
+        return np.zeros(0, dtype=[tuple(field) for field in read_manifest(paths[0])['dtype']])
+    return np.concatenate(chunks)
+
+def export_text(path, out, delimiter=',', float_format='{:.7g}'):
+    """
+    Writes the records of a ChunkedWriter directory to the file object out as
+    delimited text, one line per record, with subarray fields flattened into
+    consecutive columns.
+    """
+    for chunk in iter_chunks(path):
+        columns = []
+        for name in chunk.dtype.names:
+            column = np.asarray(chunk[name]).reshape(len(chunk), -1)
+            for values in column.T:
+                if values.dtype.kind == 'S':
+                    columns.append([value.decode('ascii') for value in values])
+                elif values.dtype.kind == 'f':
+                    columns.append([float_format.format(float(value)) for value in values])
+                else:
+                    columns.append([str(value) for value in values])
+        for fields in zip(*columns):
+            out.write(delimiter.join(fields) + '\n')
+
+if __name__ == '__main__':
+    export_text(sys.argv[1], sys.stdout, sys.argv[2] if len(sys.argv) > 2 else ',')
@@ -0,0 +1,121 @@
+from __future__ import absolute_import, division, print_function
+import json, numpy as np, os, shutil
+from mpra_io import decode, encode
+
+class ElementStore(object):
+    """
+    Random access store of element sequences and coordinates, replacing the
+    single line id_dict.txt JSON.
+
+    A store is a directory of .npy columns that are memory mapped on open, so
+    opening costs the same for any number of elements and a worker reads only
+    the elements it asks for:
+
+        keys.npy        element keys, in the store's fixed order
+        sorted_keys.npy, sorted_index.npy   keys in sorted order and their rows,
+                                            for binary search lookup
+        packed.npy      sequences packed 2 bits per base (bases order), 4 per byte
+        offsets.npy     (N + 1) base offsets of each sequence into packed
+        chroms.npy, starts.npy, ends.npy    coordinate columns
+
+    Entries are (key, sequence, (chrom, start, end)) like id_to_seq items.
+    """
+
+    columns = ('keys', 'sorted_keys', 'sorted_index', 'packed', 'offsets', 'chroms', 'starts', 'ends')
+
+    def __init__(self, path):
+        self.path = path
+        for column in self.columns:
+            setattr(self, column, np.load(os.path.join(path, column + '.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        return self.key(i), self.sequence(i), self.coords(i)
+
+    def __iter__(self):
+        return self.iter_range(0, len(self))
+
+    def iter_range(self, begin, end):
+        """
+        Yields the entries of rows begin to end - 1, e.g. one worker's share.
+        """
+        for i in range(begin, min(end, len(self))):
+            yield self[i]
+
+    def key(self, i):
+        return self.keys[i].decode('ascii')
+
+    def index(self, key):
+        """
+        Returns the row of key, raising KeyError if it is not in the store.
+        """
+        encoded = key.encode('ascii')
+        position = np.searchsorted(self.sorted_keys, encoded)
+        if position == len(self) or self.sorted_keys[position] != encoded:
+            raise KeyError(key)
+        return int(self.sorted_index[position])
+
+    def codes(self, i):
+        """
+        Returns the sequence of row i as uint8 codes indexing bases.
+        """
+        begin, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        packed = np.asarray(self.packed[begin // 4:(end + 3) // 4])
+        codes = (packed[:, np.newaxis] >> np.arange(0, 8, 2, dtype=np.uint8)) & 3
+        return codes.ravel()[begin % 4:begin % 4 + end - begin]
+
+    def sequence(self, i):
+        return decode(self.codes(i))
+
+    def coords(self, i):
+        return self.chroms[i].decode('ascii'), int(self.starts[i]), int(self.ends[i])
+
+    @staticmethod
+    def write(path, keys, seqs, coords):
+        """
+        Writes a store of keys (in the given order), sequences and (chrom, start,
+        end) coordinates to the directory path, replacing any existing store.
+        'N' bases are stored as 'A'.
+        """
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        codes = encode([''.join(seqs)])[0] if len(seqs) else np.zeros(0, dtype=np.uint8)
+        codes = np.concatenate([codes, np.zeros(-len(codes) % 4, dtype=np.uint8)]).reshape(-1, 4)
+        packed = (codes << np.arange(0, 8, 2, dtype=np.uint8)).sum(axis=1, dtype=np.uint8)
+        keys = np.array([key.encode('ascii') for key in keys], dtype=bytes)
+        sorted_index = np.argsort(keys, kind='mergesort')
+        chroms, starts, ends = zip(*coords) if len(coords) else ((), (), ())
+        arrays = {
+            'keys': keys,
+            'sorted_keys': keys[sorted_index],
+            'sorted_index': sorted_index.astype(np.int64),
+            'packed': packed,
+            'offsets': offsets,
+            'chroms': np.array([str(chrom).encode('ascii') for chrom in chroms], dtype=bytes),
+            'starts': np.array(starts, dtype=np.int64),
+            'ends': np.array(ends, dtype=np.int64),
+        }
+        tmp_path = path.rstrip('/') + '.tmp'
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        for column, array in arrays.items():
+            np.save(os.path.join(tmp_path, column + '.npy'), array)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        return ElementStore(path)
+
+    @staticmethod
+    def from_id_dict(id_dict_fname, path):
+        """
+        Converts an id_dict.txt JSON mapping key -> (sequence, (chrom, start, end))
+        to a store, with keys in sorted order.
+        """
+        with open(id_dict_fname) as f:
+            id_to_seq = json.load(f)
+        keys = sorted(id_to_seq)
+        return ElementStore.write(path, keys, [id_to_seq[key][0].upper() for key in keys],
+                                  [id_to_seq[key][1] for key in keys])
@@ -3,37 +3,30 @@
 # positions is a dict keys: position (int), values deeplift score
 
 import sys
-import json
+from element_store import ElementStore
+from chunked_output import ChunkedWriter
 import numpy as np
 from dragonn import models
 
 begin = int(sys.argv[1])
 end = int(sys.argv[2])
-out = open(sys.argv[3], 'w')
+out = ChunkedWriter(sys.argv[3], [('chrom', 'S5'), ('start', 'i8'), ('scores', 'f4', (4, 295))])
 
 model = models.SequenceDNN_Regression.load("model.arch.json", "model.weights.h5")
 
-f = open("../../id_dict_gen/id_dict.txt", 'r')
-id_to_seq = json.loads(f.readlines()[0])
-f.close()
+store = ElementStore("../../id_dict_gen/elements")
 
 base_to_row = {'A': 0, 'T': 1, 'C': 2, 'G': 3}
 
-for name in id_to_seq.keys()[int(sys.argv[1]):int(sys.argv[2])]:
-    sequence, coords = str(id_to_seq[name][0]), id_to_seq[name][1]
+for name, sequence, coords in store.iter_range(int(sys.argv[1]), int(sys.argv[2])):
     chrom, start, end = str(coords[0]), coords[1], coords[2]
     model_input = np.zeros((1, 1, 4, 295))
     for j in xrange(295):
         # coordinates chrom, start + 5 * i + j
         model_input[0][0][base_to_row[sequence[j]]][j] = 1
     D = model.deeplift(model_input)
-    entry = []
-    for task in range(4):
-        for pos in range(295):
-            scores = D[task][0][0][:, pos]
-            if max(scores) != 0:
-                entry += [max(scores)]
-            else:
-                entry += [min(scores)]
-    out.write(','.join([chrom, str(start)] + map(str, entry)) + '\n')
+    # per task and position, the max score over bases, or the min if the max is 0
+    scores = D[:, 0, 0]
+    entry = np.where(scores.max(axis=1) != 0, scores.max(axis=1), scores.min(axis=1))
+    out.append(chrom=chrom, start=start, scores=entry)
 out.close()
@@ -19,25 +19,36 @@ def bases(chrom, start, end):
 
 import numpy as np
 from collections import defaultdict
-import json
-from dragonn import models
+import sys
+from element_store import ElementStore
+from chunked_output import ChunkedWriter
+from models.numpy_model import NumpyModel
 
-model = models.SequenceDNN_Regression.load("models/models/145_weighted.arch.json", "models/models/145_weighted.weights.h5")
+model = NumpyModel.load("models/models/145_weighted.arch.json", "models/models/145_weighted.weights.h5")
 
-f = open("../../id_dict_gen/id_dict.txt", 'r')
-id_to_seq = json.loads(f.readlines()[0])
+store = ElementStore("../../id_dict_gen/elements")
+# optional rows begin to end - 1 of the store, e.g. one worker's share
+begin_row = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+end_row = int(sys.argv[3]) if len(sys.argv) > 3 else len(store)
 
 experiments = [("minP", "HepG2"), ("minP", "K562"), ("SV40P", "HepG2"), ("SV40P", "K562")]
 ism = {}
 base_to_row = {'A': 0, 'T': 1, 'C': 2, 'G': 3}
 
-def write(experiments, chrom, start, i, j, k, ISM):
-    low, high = min(ISM[k][0][0][:, j]), max(ISM[k][0][0][:, j])
-    score = low if abs(low) > abs(high) else high
-    print ','.join(map(str, [experiments[k][0], experiments[k][1], chrom, (start + (i * 29) + j), score]))
+out = ChunkedWriter(sys.argv[1] if len(sys.argv) > 1 else "ism_out",
+                    [('promoter', 'S5'), ('cell', 'S5'), ('chrom', 'S5'), ('position', 'i8'), ('score', 'f4')])
 
-for name in id_to_seq.keys():
-    sequence, coords = str(id_to_seq[name][0]), id_to_seq[name][1]
+def write(experiments, chrom, start, end, i, ISM, clip):
+    # per experiment and position, the ISM score of largest magnitude over bases
+    low, high = ISM[:, 0, 0].min(axis=1), ISM[:, 0, 0].max(axis=1)
+    scores = np.where(np.abs(low) > np.abs(high), low, high)
+    positions = start + (i * 29) + np.arange(145)
+    keep = (positions >= start) & (positions < end) if clip else slice(None)
+    for k in xrange(len(experiments)):
+        out.append(promoter=experiments[k][0], cell=experiments[k][1], chrom=chrom,
+                   position=positions[keep], score=scores[k][keep])
+
+for name, sequence, coords in store.iter_range(begin_row, end_row):
     chrom, start, end = str(coords[0]), int(coords[1]), int(coords[2])
     for i in xrange(-4, 0):
         model_input = np.zeros((1, 1, 4, 145))
@@ -45,29 +56,22 @@ for name in id_to_seq.keys():
         for j in xrange(145):
             model_input[0][0][base_to_row[subseq[j]]][j] = 1
         ISM = model.in_silico_mutagenesis(model_input)
-        for j in xrange(145):
-            # we are looking at position: start + (i * 29) + j
-            if (start + (i * 29) + j) in range(start, end):
-                for k in xrange(len(experiments)):
-                    write(experiments, chrom, start, i, j, k, ISM)
+        # only positions within the element, start + (i * 29) + j
+        write(experiments, chrom, start, end, i, ISM, clip=True)
     for i in xrange(0, 6):
         model_input = np.zeros((1, 1, 4, 145))
         subseq = sequence[(i * 29) : (i * 29) + 145].upper().replace("N", "A")
         for j in xrange(145):
             model_input[0][0][base_to_row[subseq[j]]][j] = 1
         ISM = model.in_silico_mutagenesis(model_input)
-        for j in xrange(145):
-            # we are looking at position: start + (i * 29) + j
-            for k in xrange(len(experiments)):
-                write(experiments, chrom, start, i, j, k, ISM)
+        # we are looking at positions: start + (i * 29) + j
+        write(experiments, chrom, start, end, i, ISM, clip=False)
     for i in xrange(6, 10):
         model_input = np.zeros((1, 1, 4, 145))
         subseq = bases(chrom, start + (i * 29), start + (i * 29) + 145).upper().replace("N", "A")
         for j in xrange(145):
             model_input[0][0][base_to_row[subseq[j]]][j] = 1
         ISM = model.in_silico_mutagenesis(model_input)
-        for j in xrange(145):
-            # we are looking at position: start + (i * 29) + j
-            if (start + (i * 29) + j) in range(start, end):
-                for k in xrange(len(experiments)):
-                    write(experiments, chrom, start, i, j, k, ISM)
+        # only positions within the element, start + (i * 29) + j
+        write(experiments, chrom, start, end, i, ISM, clip=True)
+out.close()
@@ -19,23 +19,33 @@ def bases(chrom, start, end):
 
 import numpy as np
 from collections import defaultdict
-import json
-from dragonn import models
+import sys
+from element_store import ElementStore
+from chunked_output import ChunkedWriter
+from models.numpy_model import NumpyModel
 from in_silico_mutagenesis import in_silico_mutagenesis
 
-model = models.SequenceDNN_Regression.load("models/models/145_weighted.arch.json", "models/models/145_weighted.weights.h5")
+model = NumpyModel.load("models/models/145_weighted.arch.json", "models/models/145_weighted.weights.h5")
 
-f = open("../../id_dict_gen/id_dict.txt", 'r')
-id_to_seq = json.loads(f.readlines()[0])
+store = ElementStore("../../id_dict_gen/elements")
+# optional rows begin to end - 1 of the store, e.g. one worker's share
+begin_row = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+end_row = int(sys.argv[3]) if len(sys.argv) > 3 else len(store)
 
 experiments = [("minP", "HepG2"), ("minP", "K562"), ("SV40P", "HepG2"), ("SV40P", "K562")]
 
-for name in id_to_seq.keys():
-    sequence, coords = str(id_to_seq[name][0]), id_to_seq[name][1]
+# BED like records; export as text with python chunked_output.py <directory> '\t'
+out = ChunkedWriter(sys.argv[1] if len(sys.argv) > 1 else "ism_onetile_out",
+                    [('chrom', 'S5'), ('start', 'i8'), ('end', 'i8'), ('experiment', 'i1'),
+                     ('score', 'f4'), ('strand', 'S1')],
+                    attrs={'experiments': experiments})
+
+for name, sequence, coords in store.iter_range(begin_row, end_row):
     chrom, start, end = str(coords[0]), int(coords[1]), int(coords[2])
     big_seq = bases(chrom, start - 72, end + 72).upper().replace('N', 'A')
     for i in xrange(295):
         middle_seq = big_seq[i : i + 145]
         ISM = in_silico_mutagenesis(model, middle_seq)
-        for j in xrange(4):
-            print '\t'.join(map(str, [chrom, start + i, start + i + 1, j, ISM[j], '+']))
+        out.append(chrom=chrom, start=start + i, end=start + i + 1, experiment=np.arange(4),
+                   score=ISM, strand='+')
+out.close()
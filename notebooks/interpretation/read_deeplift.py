@@ -1,24 +1,84 @@
 from glob import glob
+import os
 import sys
 import numpy as np
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from chunked_output import load_chunks
 
 tasks = [("HepG2", "minP"), ("K562", "minP"), ("HepG2", "SV40P"), ("K562", "SV40P")]
+length = 145 # scores per task in each get_deeplift record
+width = 120 # positions scored per tile
 
-def get_deep(directory):
-    deeplift = {task: {} for task in tasks} # experiment -> chrom -> start_position
+def load_deep(directory, length=length, width=width):
+    # all records of the get_deeplift outputs in directory as one structured array,
+    # ChunkedWriter directories loaded without parsing, CSV files parsed;
+    # read_deeplift_295 reads whole 295 bp elements with length = width = 295
+    dtype = [('chrom', 'S5'), ('start', 'i8'), ('scores', 'f4', (len(tasks), width))]
+    parts = []
     for f in glob(directory+'*'):
         print f
+        if os.path.isdir(f):
+            records = load_chunks(f)
+            part = np.zeros(len(records), dtype=dtype)
+            part['chrom'], part['start'] = records['chrom'], records['start']
+            part['scores'] = records['scores'][:, :, :width]
+            parts.append(part)
+            continue
+        rows = []
         with open(f) as deep_data:
             for line in deep_data:
-                parts = line.split(',')
-                chrom, start = parts[:2]
-                if len(parts) != 582: continue
-                data = map(float, parts[2:])
-                start = int(start)
-                for i, task in enumerate(tasks):
-                    if chrom not in deeplift[task]: deeplift[task][chrom] = {}
-                    for shift in range(120):
-                        pos = start + shift
-                        if pos not in deeplift[task][chrom]: deeplift[task][chrom][pos] = []
-                        deeplift[task][chrom][pos] += [data[shift + i*145]]
+                fields = line.split(',')
+                if len(fields) != 2 + len(tasks) * length: continue
+                rows.append((fields[0], int(fields[1]),
+                             np.array(fields[2:], dtype=np.float32).reshape(len(tasks), length)[:, :width]))
+        parts.append(np.array(rows, dtype=dtype))
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+class PositionScores(Mapping):
+    # position -> scores of every tile covering it, as a view of one sorted array
+    def __init__(self, positions, bounds, scores):
+        self.positions = positions # sorted unique positions
+        self.bounds = bounds # scores of positions[i] are scores[bounds[i]:bounds[i + 1]]
+        self.scores = scores
+
+    def __getitem__(self, pos):
+        i = np.searchsorted(self.positions, pos)
+        if i == len(self.positions) or self.positions[i] != pos: raise KeyError(pos)
+        return self.scores[self.bounds[i]:self.bounds[i + 1]]
+
+    def __iter__(self):
+        return iter(self.positions.tolist())
+
+    def __len__(self):
+        return len(self.positions)
+
+    def items(self):
+        return [(pos, self.scores[begin:end]) for pos, begin, end in
+                zip(self.positions.tolist(), self.bounds[:-1].tolist(), self.bounds[1:].tolist())]
+
+    def means(self):
+        # (positions, mean score per position)
+        return self.positions, np.add.reduceat(self.scores, self.bounds[:-1], dtype=np.float64) / np.diff(self.bounds)
+
+def get_deep(directory, length=length, width=width):
+    # experiment -> chrom -> PositionScores
+    records = load_deep(directory, length, width)
+    chroms = np.repeat(records['chrom'], width)
+    positions = (records['start'][:, None] + np.arange(width)).ravel()
+    order = np.lexsort((positions, chroms)) # stable, so tiles stay in file order
+    chroms, positions = chroms[order], positions[order]
+    task_scores = [records['scores'][:, i].ravel()[order] for i in range(len(tasks))]
+    deeplift = {task: {} for task in tasks}
+    chrom_bounds = np.concatenate([[0], np.flatnonzero(chroms[1:] != chroms[:-1]) + 1, [len(chroms)]])
+    for begin, end in zip(chrom_bounds[:-1], chrom_bounds[1:]):
+        if begin == end: continue
+        chrom = str(chroms[begin].decode('ascii'))
+        chrom_positions = positions[begin:end]
+        starts = np.concatenate([[0], np.flatnonzero(chrom_positions[1:] != chrom_positions[:-1]) + 1])
+        bounds = np.append(starts, end - begin)
+        for task, scores in zip(tasks, task_scores):
+            deeplift[task][chrom] = PositionScores(chrom_positions[starts], bounds, scores[begin:end])
     return deeplift
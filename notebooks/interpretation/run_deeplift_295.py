@@ -2,7 +2,7 @@ import subprocess
 
 num = 200
 procs = 5
-out = lambda x: "deeplift_out/deep_test{}.csv".format(x)
+out = lambda x: "deeplift_out/deep_test{}".format(x)
 frags = range(0, num, num / procs) + [num]
 
 tasks = []
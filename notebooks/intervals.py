@@ -0,0 +1,191 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np, struct, zlib
+from collections import OrderedDict
+
+DNASE_PEAK_FILES = OrderedDict([
+    ('HepG2', '../data/dnase/wgEncodeUWDukeDnaseHepG2.fdr01peaks.hg19.bb'),
+    ('K562', '../data/dnase/wgEncodeUWDukeDnaseK562.fdr01peaks.hg19.bb'),
+])
+BIGBED_MAGIC = 0x8789F2EB
+
+def normalize_chrom(chrom):
+    """
+    Strips a leading 'chr' so 'chr20' and '20' index the same chromosome.
+    """
+    return chrom[3:] if chrom.startswith('chr') else chrom
+
+def read_bed(path):
+    """
+    Returns (chroms, starts, ends) arrays from the first three columns of a BED
+    file, or of a bigBed file if path ends in .bb (see read_bigbed).
+    """
+    if path.endswith('.bb'):
+        return read_bigbed(path)
+    chroms, starts, ends = [], [], []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(('#', 'track', 'browser')):
+                continue
+            chrom, start, end = line.split(None, 3)[:3]
+            chroms.append(normalize_chrom(chrom))
+            starts.append(start)
+            ends.append(end)
+    return (np.array(chroms), np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64))
+
+def read_bigbed(path):
+    """
+    Returns (chroms, starts, ends) arrays of the intervals in a bigBed file, as
+    bigBedToBed would list them, without needing the UCSC tools.
+
+    Reads the chromosome names from the header's B+ tree, then decompresses the
+    data blocks, which bedToBigBed writes back to back between the data and
+    index offsets.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, = struct.unpack('<I', data[:4])
+    endian = '<' if magic == BIGBED_MAGIC else '>'
+    if struct.unpack(endian + 'I', data[:4])[0] != BIGBED_MAGIC:
+        raise ValueError("{} is not a bigBed file".format(path))
+    (chrom_tree_offset, data_offset, index_offset, uncompress_buf_size) = [
+        struct.unpack_from(endian + fmt, data, offset)[0]
+        for fmt, offset in (('Q', 8), ('Q', 16), ('Q', 24), ('I', 52))]
+    chrom_names = _read_chrom_tree(data, chrom_tree_offset, endian)
+    num_records, = struct.unpack_from(endian + 'Q', data, data_offset)
+    blocks, position = [], data_offset + 8
+    while position < index_offset:
+        if uncompress_buf_size:
+            decompressor = zlib.decompressobj()
+            blocks.append(decompressor.decompress(data[position:index_offset]))
+            position = index_offset - len(decompressor.unused_data)
+        else:
+            blocks.append(data[position:index_offset])
+            position = index_offset
+    chroms, starts, ends = [], [], []
+    for block in blocks:
+        position = 0
+        while position < len(block):
+            chrom_id, start, end = struct.unpack_from(endian + 'III', block, position)
+            chroms.append(chrom_names[chrom_id])
+            starts.append(start)
+            ends.append(end)
+            position = block.index(b'\0', position + 12) + 1
+    if len(starts) != num_records:
+        raise ValueError("Read {} of the {} intervals in {}".format(len(starts), num_records, path))
+    return (np.array(chroms), np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64))
+
+def _read_chrom_tree(data, offset, endian):
+    # chrom id -> normalized name, from the leaves of the bigBed B+ tree
+    key_size, = struct.unpack_from(endian + 'I', data, offset + 8)
+    names = {}
+    nodes = [offset + 32]
+    while nodes:
+        node = nodes.pop()
+        is_leaf, _, count = struct.unpack_from(endian + 'BBH', data, node)
+        for i in range(count):
+            item = node + 4 + i * (key_size + 8)
+            if is_leaf:
+                key = data[item:item + key_size].rstrip(b'\0').decode('ascii')
+                names[struct.unpack_from(endian + 'I', data, item + key_size)[0]] = normalize_chrom(key)
+            else:
+                nodes.append(struct.unpack_from(endian + 'Q', data, item + key_size)[0])
+    return names
+
+class IntervalIndex(object):
+    """
+    Overlap index over a set of genomic intervals, e.g. the DNase peaks of one
+    cell type.
+
+    Intervals are merged per chromosome into sorted, disjoint runs with a prefix
+    sum of their lengths, so the number of covered bases in a query [start, end)
+    is the difference of two np.searchsorted lookups. Queries are annotated as
+    whole arrays, one vectorized pass per chromosome.
+    """
+
+    def __init__(self, chroms, starts, ends):
+        # Normalize first, so 'chr1' and '1' rows are merged into one chromosome
+        names, inverse = np.unique(np.asarray(chroms).astype(str), return_inverse=True)
+        chroms = np.array([normalize_chrom(name) for name in names])[inverse.ravel()]
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        self.runs = {}
+        for chrom in np.unique(chroms):
+            mask = chroms == chrom
+            self.runs[str(chrom)] = self._merge(starts[mask], ends[mask])
+
+    @classmethod
+    def from_bed(cls, path):
+        return cls(*read_bed(path))
+
+    @staticmethod
+    def _merge(starts, ends):
+        order = np.argsort(starts, kind='mergesort')
+        starts, ends = starts[order], ends[order]
+        running_end = np.maximum.accumulate(ends)
+        new_run = np.ones(len(starts), dtype=bool)
+        new_run[1:] = starts[1:] > running_end[:-1]
+        run_starts = starts[new_run]
+        run_ends = np.maximum.reduceat(ends, np.flatnonzero(new_run))
+        lengths = run_ends - run_starts
+        prefix = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        return run_starts, lengths, prefix
+
+    @staticmethod
+    def _covered_before(runs, positions):
+        # Number of covered bases strictly before each position.
+        run_starts, lengths, prefix = runs
+        run = np.searchsorted(run_starts, positions, side='right') - 1
+        safe_run = np.maximum(run, 0)
+        inside = np.clip(positions - run_starts[safe_run], 0, lengths[safe_run])
+        return np.where(run >= 0, prefix[safe_run] + inside, 0)
+
+    def coverage(self, chroms, starts, ends):
+        """
+        Returns the number of bases of each query interval covered by the index.
+        """
+        chroms = np.asarray(chroms)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        covered = np.zeros(len(starts), dtype=np.int64)
+        for chrom in np.unique(chroms):
+            runs = self.runs.get(normalize_chrom(str(chrom)))
+            if runs is None or len(runs[0]) == 0:
+                continue
+            mask = chroms == chrom
+            covered[mask] = (self._covered_before(runs, ends[mask]) -
+                             self._covered_before(runs, starts[mask]))
+        return covered
+
+    def overlap_fraction(self, chroms, starts, ends):
+        """
+        Returns the fraction of each query interval covered by the index.
+        """
+        lengths = np.asarray(ends, dtype=np.int64) - np.asarray(starts, dtype=np.int64)
+        return self.coverage(chroms, starts, ends) / np.maximum(lengths, 1)
+
+    def overlaps(self, chroms, starts, ends):
+        return self.coverage(chroms, starts, ends) > 0
+
+class PeakAnnotator(object):
+    """
+    Annotates intervals against several peak sets at once (e.g. one per cell type).
+
+    annotate() returns a N x num_peak_sets float32 matrix of overlap fractions whose
+    columns follow feature_names, ready for MrpaData.merge_features.
+    """
+
+    def __init__(self, peak_files=DNASE_PEAK_FILES):
+        self.indexes = OrderedDict(
+            (name, IntervalIndex.from_bed(path)) for name, path in peak_files.items())
+
+    @property
+    def feature_names(self):
+        return ['{}_dnase_overlap'.format(name) for name in self.indexes]
+
+    def annotate(self, chroms, starts, ends):
+        return np.array([
+                index.overlap_fraction(chroms, starts, ends)
+                for index in self.indexes.values()
+                ], dtype=np.float32).T
@@ -1,6 +1,7 @@
 import numpy as np
 from math import log
 from sklearn.model_selection import train_test_split
+from barcode_counts import dispersion_variance
 
 data_dir = '~/cs273b-project/data/Scaleup_counts_sequences'
 promoters = ['minP', 'SV40P']
@@ -38,20 +39,11 @@ def normalized_scores(dna, rna1, rna2, labels):
     return rep1, rep2, dna_count
 
 def get_weights(dna_count, rep1, rep2):
-    # Fit transform and regressor on valid data
-    valid_avg       = [(r1+r2)    / 2 for r1, r2, dna in zip(rep1, rep2, dna_count) if dna > 19]
-    valid_variance  = [(r1-r2)**2 / 2 for r1, r2, dna in zip(rep1, rep2, dna_count) if dna > 19]
-    valid_dna_count = [dna for dna in dna_count if dna > 19]
-    
-    scaler = StandardScaler()
-    valid_X = scaler.fit_transform(np.array([valid_dna_count, valid_avg]).T)
-    regressor = KNeighborsRegressor(n_neighbors = 200).fit(valid_X, valid_variance)
-
-    # Run on complete dataset and then mask nonvalid values
-    avg = [(r1+r2) / 2 for r1, r2 in zip(rep1, rep2)]
-    X = scaler.transform(np.array([dna_count, avg]).T)
-    
-    return [1 / var if valid else 0 for var, valid in zip(regressor.predict(X), dna_count)]
+    # Inverse variance of each element's mean from the spread of its replicates,
+    # shrunk towards the pooled variance; elements with dna < 20 get weight 0
+    valid = np.array(dna_count) > 19
+    variance = dispersion_variance(np.array([rep1, rep2]).T, np.array([valid, valid]).T)
+    return list(1 / variance)
 
 def get_labels():
     labels = {}
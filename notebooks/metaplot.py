@@ -0,0 +1,151 @@
+from __future__ import absolute_import, division, print_function
+import gzip, io, multiprocessing, numpy as np
+from collections import Counter
+from warnings import warn
+from mpra_io import encode, one_hot, strided_tiles
+
+def read_fasta_codes(path):
+    """
+    Returns (names, codes) for a (gzipped) FASTA file such as upstream5000.fa.gz,
+    with codes a N x seq_length uint8 array. Sequences whose length differs from
+    the most common one are skipped.
+    """
+    names, seqs, lines = [], [], []
+    with (io.TextIOWrapper(gzip.open(path)) if path.endswith('.gz') else open(path)) as f:
+        for line in f:
+            if line.startswith('>'):
+                if lines:
+                    seqs.append(''.join(lines).upper())
+                names.append(line[1:].strip())
+                lines = []
+            else:
+                lines.append(line.strip())
+    if lines:
+        seqs.append(''.join(lines).upper())
+    seq_length = Counter(len(seq) for seq in seqs).most_common(1)[0][0]
+    keep = [i for i, seq in enumerate(seqs) if len(seq) == seq_length]
+    if len(keep) < len(seqs):
+        warn("Skipping {} sequences that are not {} bp long.".format(len(seqs) - len(keep), seq_length))
+    return [names[i] for i in keep], encode([seqs[i] for i in keep])
+
+class MetaplotAccumulator(object):
+    """
+    Running per offset, per task statistics of predictions, without keeping the
+    predictions themselves: count, mean and variance from running sums, the
+    fraction above each threshold, and quantiles from a fixed bin histogram.
+    Accumulators over disjoint data can be merged.
+    """
+
+    def __init__(self, num_offsets, num_tasks, thresholds=(), bins=np.linspace(-4, 4, 801)):
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.bins = np.asarray(bins, dtype=np.float64)
+        self.count = np.zeros(num_offsets, dtype=np.int64)
+        self.sum = np.zeros((num_offsets, num_tasks))
+        self.sum_squares = np.zeros((num_offsets, num_tasks))
+        self.above = np.zeros((num_offsets, num_tasks, len(self.thresholds)), dtype=np.int64)
+        # Histogram with an underflow and an overflow bin
+        self.histogram = np.zeros((num_offsets, num_tasks, len(self.bins) + 1), dtype=np.int64)
+
+    def update(self, offset_index, predictions):
+        predictions = np.asarray(predictions, dtype=np.float64)
+        self.count[offset_index] += len(predictions)
+        self.sum[offset_index] += predictions.sum(axis=0)
+        self.sum_squares[offset_index] += (predictions ** 2).sum(axis=0)
+        self.above[offset_index] += (predictions[:, :, np.newaxis] > self.thresholds).sum(axis=0)
+        bin_index = np.searchsorted(self.bins, predictions)
+        for task, task_bins in enumerate(bin_index.T):
+            self.histogram[offset_index, task] += np.bincount(task_bins, minlength=len(self.bins) + 1)
+
+    def merge(self, other):
+        for attribute in ('count', 'sum', 'sum_squares', 'above', 'histogram'):
+            setattr(self, attribute, getattr(self, attribute) + getattr(other, attribute))
+        return self
+
+    def mean(self):
+        return self.sum / self.count[:, np.newaxis]
+
+    def variance(self):
+        return self.sum_squares / self.count[:, np.newaxis] - self.mean() ** 2
+
+    def fraction_above(self, threshold):
+        """
+        Returns the (num_offsets, num_tasks) fraction of predictions > threshold,
+        which must be one of self.thresholds.
+        """
+        index = list(self.thresholds).index(threshold)
+        return self.above[:, :, index] / self.count[:, np.newaxis]
+
+    def quantile(self, q):
+        """
+        Returns the (num_offsets, num_tasks) q-quantile, accurate to the bin width.
+        """
+        cumulative = np.cumsum(self.histogram, axis=-1)
+        target = q * cumulative[:, :, -1:]
+        bin_index = np.clip((cumulative < target).sum(axis=-1), 1, len(self.bins) - 1)
+        return (self.bins[bin_index - 1] + self.bins[bin_index]) / 2
+
+    def median(self):
+        return self.quantile(0.5)
+
+def _accumulate(predict, windows, offset_indices, num_tasks, batch_size, accumulator_kwargs):
+    accumulator = MetaplotAccumulator(len(windows), num_tasks, **accumulator_kwargs)
+    for offset_index in offset_indices:
+        for start in range(0, windows.shape[1], batch_size):
+            X = windows[offset_index, start:start + batch_size].astype(np.float32)
+            accumulator.update(offset_index, predict(X))
+    return accumulator
+
+_worker = {}
+
+def _init_worker(model_loader, windows, num_tasks, batch_size, accumulator_kwargs):
+    _worker.update(model=model_loader(), windows=windows, num_tasks=num_tasks,
+                   batch_size=batch_size, accumulator_kwargs=accumulator_kwargs)
+
+def _accumulate_in_worker(offset_indices):
+    return _accumulate(_worker['model'].predict, _worker['windows'], offset_indices,
+                       _worker['num_tasks'], _worker['batch_size'], _worker['accumulator_kwargs'])
+
+def metaplot(model_loader, codes, window_length=145, stride=29, num_tasks=4,
+             batch_size=4096, processes=1, **accumulator_kwargs):
+    """
+    Scores every window_length window, every stride bp, of each sequence.
+
+    The sequences are one hot encoded once into a uint8 buffer and windows are
+    strided views of it, copied to float32 one batch at a time. Batches are
+    streamed offset by offset into a MetaplotAccumulator.
+
+    Parameters
+    ----------
+    model_loader : callable
+        returns a model with a predict method, e.g.
+        functools.partial(SequenceDNN_Regression.load, arch_fname, weights_fname).
+        Called once per process.
+    codes : np.array
+        N x seq_length uint8 base codes, e.g. from read_fasta_codes.
+    processes : int
+        number of worker processes, each scoring a share of the offsets. Default: 1.
+    accumulator_kwargs
+        thresholds and bins of the MetaplotAccumulator.
+
+    Returns
+    -------
+    (offsets, MetaplotAccumulator)
+    """
+    buffer = one_hot(codes, dtype=np.uint8)
+    windows = strided_tiles(buffer, window_length, stride)  # (num_offsets, N, 1, 4, window_length)
+    offsets = np.arange(len(windows)) * stride
+    if processes == 1:
+        return offsets, _accumulate(model_loader().predict, windows, range(len(windows)),
+                                    num_tasks, batch_size, accumulator_kwargs)
+    shares = [list(range(len(windows)))[i::processes] for i in range(processes)]
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (model_loader, windows, num_tasks, batch_size, accumulator_kwargs))
+    try:
+        accumulators = pool.map(_accumulate_in_worker, shares)
+    finally:
+        pool.close()
+        pool.join()
+    accumulator = accumulators[0]
+    for other in accumulators[1:]:
+        accumulator.merge(other)
+    return offsets, accumulator
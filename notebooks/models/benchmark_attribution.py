@@ -0,0 +1,50 @@
+"""
+Times gradient x input and integrated gradients against deeplift on random
+sequences, and reports how well their scores agree with deeplift: the mean over
+sequences and tasks of the Pearson correlation of the (num_bases, sequence_length)
+score maps.
+
+deeplift mean normalises the first convolution's weights in place, so the
+gradient based scores are computed first.
+
+Usage: python benchmark_attribution.py <model prefix> [num_sequences] [steps ...]
+e.g.   python benchmark_attribution.py models/145_weighted 1000 10 20 50
+"""
+from __future__ import absolute_import, division, print_function
+import sys, time, numpy as np
+from models import SequenceDNN_Regression
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+def mean_correlation(scores, reference):
+    scores = scores.reshape(scores.shape[:2] + (-1,))
+    reference = reference.reshape(reference.shape[:2] + (-1,))
+    scores = scores - scores.mean(axis=-1, keepdims=True)
+    reference = reference - reference.mean(axis=-1, keepdims=True)
+    correlations = (scores * reference).sum(axis=-1) / np.sqrt(
+        (scores ** 2).sum(axis=-1) * (reference ** 2).sum(axis=-1))
+    return np.nanmean(correlations)
+
+if __name__ == '__main__':
+    prefix = sys.argv[1]
+    num_sequences = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    all_steps = [int(steps) for steps in sys.argv[3:]] or [10, 20, 50]
+    model = SequenceDNN_Regression.load(prefix + '.arch.json', prefix + '.weights.h5')
+    num_channels, num_bases, sequence_length = model.model.input_shape[1:]
+    codes = np.random.RandomState(0).randint(num_bases, size=(num_sequences, sequence_length))
+    X = (codes[:, np.newaxis, np.newaxis, :] == np.arange(num_bases)[:, np.newaxis]).astype(np.float32)
+
+    model.gradient_times_input(X[:1])  # compile the gradient function outside the timings
+    results = [('gradient x input',) + timed(model.gradient_times_input, X)]
+    for steps in all_steps:
+        results.append(('integrated gradients, {} steps'.format(steps),) +
+                       timed(model.integrated_gradients, X, steps=steps))
+    reference, reference_time = timed(model.deeplift, X)
+    print('deeplift:\t{:.0f} seqs/s'.format(num_sequences / reference_time))
+    for name, scores, elapsed in results:
+        print('{}:\t{:.0f} seqs/s ({:.2f}x)\tmean correlation with deeplift {:.3f}'.format(
+            name, num_sequences / elapsed, reference_time / elapsed,
+            mean_correlation(scores, reference)))
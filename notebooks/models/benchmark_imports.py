@@ -0,0 +1,40 @@
+"""
+Times importing the predict only path (models, metrics, numpy_model and
+prediction_cache) in fresh interpreters, and fails if the median exceeds the
+budget or the imports load matplotlib, Keras, Theano, sklearn or prg.
+
+Usage: python benchmark_imports.py [budget_ms] [repeats]
+e.g.   python benchmark_imports.py 300 5
+"""
+from __future__ import absolute_import, division, print_function
+import json, os, subprocess, sys, numpy as np
+
+HEAVY_MODULES = ['matplotlib', 'keras', 'theano', 'sklearn', 'prg', 'deeplift', 'dragonn']
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.time()
+import numpy
+numpy_time = time.time() - start
+import models, metrics, numpy_model, prediction_cache
+print(json.dumps({'total': time.time() - start, 'numpy': numpy_time,
+                  'heavy': sorted(set(name.split('.')[0] for name in sys.modules) & set(%r))}))
+""" % HEAVY_MODULES
+
+def time_imports():
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.3
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    results = [time_imports() for _ in range(repeats)]
+    total = np.median([result['total'] for result in results])
+    numpy_time = np.median([result['numpy'] for result in results])
+    heavy = sorted(set(name for result in results for name in result['heavy']))
+    print('Predict only imports: median {:.0f} ms ({:.0f} ms of it numpy) over {} runs, budget {:.0f} ms'.format(
+        1000 * total, 1000 * numpy_time, repeats, 1000 * budget))
+    assert not heavy, 'Heavy modules imported: {}'.format(', '.join(heavy))
+    assert total <= budget, 'Import time {:.0f} ms exceeds the {:.0f} ms budget'.format(
+        1000 * total, 1000 * budget)
@@ -0,0 +1,40 @@
+"""
+Times NumpyModel predict and in_silico_mutagenesis against its float16 and int8
+QuantizedModels on random sequences, and reports how far their predictions are
+from float32. QuantizedModel.predict runs the same float32 forward pass, so only
+its in_silico_mutagenesis is expected to be faster.
+
+Usage: python benchmark_numpy_model.py <model prefix> [num_sequences] [num_ism_sequences]
+e.g.   python benchmark_numpy_model.py models/145_weighted 20000 5
+"""
+from __future__ import absolute_import, division, print_function
+import sys, time, numpy as np
+from numpy_model import NumpyModel
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+if __name__ == '__main__':
+    prefix = sys.argv[1]
+    num_sequences = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    num_ism_sequences = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    model, load_time = timed(NumpyModel.load, prefix + '.arch.json', prefix + '.weights.h5')
+    print('Loaded {} in {:.1f} ms'.format(prefix, 1000 * load_time))
+    num_channels, num_bases, sequence_length = model.input_shape
+    codes = np.random.RandomState(0).randint(num_bases, size=(num_sequences, sequence_length))
+    X = (codes[:, np.newaxis, np.newaxis, :] == np.arange(num_bases)[:, np.newaxis]).astype(np.float32)
+    reference, reference_time = timed(model.predict, X)
+    reference_ism, reference_ism_time = timed(model.in_silico_mutagenesis, X[:num_ism_sequences])
+    print('float32:\tpredict {:.0f} seqs/s\tISM {:.2f} seqs/s'.format(
+        num_sequences / reference_time, num_ism_sequences / reference_ism_time))
+    for weight_dtype in ('float16', 'int8'):
+        quantized_model = model.quantize(weight_dtype)
+        predictions, predict_time = timed(quantized_model.predict, X)
+        ism, ism_time = timed(quantized_model.in_silico_mutagenesis, X[:num_ism_sequences])
+        print('{}:\tpredict {:.0f} seqs/s ({:.2f}x)\tISM {:.2f} seqs/s ({:.2f}x)\t'
+              'max |prediction delta| {:.2e}\tmax |ISM delta| {:.2e}'.format(
+            weight_dtype, num_sequences / predict_time, reference_time / predict_time,
+            num_ism_sequences / ism_time, reference_ism_time / ism_time,
+            np.abs(predictions - reference).max(), np.abs(ism - reference_ism).max()))
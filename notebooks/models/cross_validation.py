@@ -0,0 +1,226 @@
+from __future__ import absolute_import, division, print_function
+import multiprocessing, numpy as np, os, shutil, tempfile
+from collections import OrderedDict
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, e.g. the Python 2 Keras / Theano stack: memory mapped files
+    shared_memory = None
+from metrics import RegressionResult
+
+def chromosome_folds(chroms, starts=None, num_folds=5, block_size=None):
+    """
+    Assigns elements to num_folds folds so that every chromosome, or with
+    block_size every block_size bp block of a chromosome, falls in a single fold.
+    Groups are placed largest first into the fold with the fewest elements.
+
+    Parameters
+    ----------
+    chroms, starts : np.array
+        element coordinates, e.g. from MrpaData.element_coords(). starts is only
+        needed with block_size.
+
+    Returns
+    -------
+    (N,) int array of fold indices.
+    """
+    chroms = np.asarray(chroms)
+    if block_size is None:
+        _, groups = np.unique(chroms, return_inverse=True)
+    else:
+        blocks = np.asarray(starts) // block_size
+        _, groups = np.unique(np.rec.fromarrays([chroms, blocks]), return_inverse=True)
+    groups = groups.ravel()
+    sizes = np.bincount(groups)
+    if len(sizes) < num_folds:
+        raise ValueError("Only {} groups for {} folds".format(len(sizes), num_folds))
+    group_folds = np.empty(len(sizes), dtype=np.int64)
+    fold_sizes = np.zeros(num_folds, dtype=np.int64)
+    for group in np.argsort(-sizes, kind='mergesort'):
+        group_folds[group] = fold_sizes.argmin()
+        fold_sizes[group_folds[group]] += sizes[group]
+    return group_folds[groups]
+
+class SharedArrays(object):
+    """
+    Copies named arrays into multiprocessing.shared_memory blocks once, or where
+    that is missing (Python < 3.8) into temporary files that every process memory
+    maps, so the pages are shared through the OS page cache. specs (picklable)
+    lets other processes attach to them without copying. Use as a context manager
+    to release the blocks.
+    """
+
+    def __init__(self, **arrays):
+        self.blocks = []
+        self.specs = {}
+        self.directory = None if shared_memory is not None else tempfile.mkdtemp(prefix='shared_arrays')
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            if shared_memory is None:
+                fname = os.path.join(self.directory, name + '.dat')
+                block = np.memmap(fname, dtype=array.dtype, mode='w+', shape=max(array.size, 1))
+                block[:array.size] = array.ravel()
+                block.flush()
+                del block
+                self.specs[name] = (fname, array.shape, array.dtype.str)
+                continue
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(specs):
+        """
+        Returns (arrays, blocks) for specs; keep blocks alive while using arrays.
+        """
+        arrays, blocks = {}, []
+        for name, (block_name, shape, dtype) in specs.items():
+            if shared_memory is None:
+                size = int(np.prod(shape))
+                arrays[name] = np.memmap(block_name, dtype=np.dtype(dtype), mode='r',
+                                         shape=max(size, 1))[:size].reshape(shape)
+                continue
+            # Pool workers share the creating process's resource tracker, so
+            # attaching does not schedule the block for removal on their exit.
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        return arrays, blocks
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _train_fold(args):
+    specs, model_factory, folds, test_fold, validation_fold, train_kwargs = args
+    arrays, blocks = SharedArrays.attach(specs)
+    try:
+        X, y = arrays['X'], arrays['y']
+        weights = arrays.get('weights')
+        test = np.flatnonzero(folds == test_fold)
+        valid = np.flatnonzero(folds == validation_fold)
+        train = np.flatnonzero((folds != test_fold) & (folds != validation_fold))
+        select = lambda indices: None if weights is None else weights[indices]
+        model = model_factory()
+        model.train(X[train], y[train], (X[valid], y[valid]),
+                    train_sample_weight=select(train), valid_sample_weight=select(valid),
+                    **train_kwargs)
+        predictions = model.predict(X[test])
+        return test, predictions, RegressionResult(y[test], predictions, select(test))
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+def cross_validate(model_factory, X, y, folds, weights=None, processes=None, task_names=None,
+                   **train_kwargs):
+    """
+    Trains and tests one model per fold. Fold k is the test set, fold k + 1 the
+    early stopping validation set and the rest the training set.
+
+    X, y and weights are placed in shared memory once; each worker process attaches
+    to them and only copies the rows its model trains on.
+
+    Parameters
+    ----------
+    model_factory : callable
+        returns a new untrained model, e.g. functools.partial(
+        SequenceDNN_Regression, seq_length=145, num_tasks=4).
+    folds : np.array
+        (N,) fold index of each element, e.g. from chromosome_folds.
+    weights : np.array, optional
+        (N,) sample weights for training, early stopping and testing, or
+        (N, num_tasks) per task weights, e.g. MrpaData.training_weights(), which
+        are averaged over tasks since Keras takes one weight per sample.
+    processes : int, optional
+        number of worker processes. Default: one per fold, up to the number of cores.
+    train_kwargs
+        passed to model.train, e.g. early_stopping_patience.
+
+    Returns
+    -------
+    CrossValidationResult
+    """
+    folds = np.asarray(folds)
+    fold_ids = np.unique(folds)
+    arrays = {'X': X, 'y': y}
+    if weights is not None:
+        weights = np.asarray(weights)
+        if weights.ndim == 2 and weights.shape[1] == np.shape(y)[1]:
+            weights = weights.mean(axis=1)
+        if weights.shape != (len(y),):
+            raise ValueError("weights must have shape (N,) or (N, num_tasks) = {}, not {}".format(
+                np.shape(y), weights.shape))
+        arrays['weights'] = weights
+    with SharedArrays(**arrays) as shared:
+        tasks = [(shared.specs, model_factory, folds, test_fold,
+                  fold_ids[(i + 1) % len(fold_ids)], train_kwargs)
+                 for i, test_fold in enumerate(fold_ids)]
+        processes = processes or min(len(tasks), multiprocessing.cpu_count())
+        if processes == 1:
+            fold_results = list(map(_train_fold, tasks))
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                fold_results = pool.map(_train_fold, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    predictions = np.empty(np.shape(y), dtype=np.float32)
+    for test, fold_predictions, _ in fold_results:
+        predictions[test] = np.asarray(fold_predictions).reshape(predictions[test].shape)
+    return CrossValidationResult(
+        [result for _, _, result in fold_results], fold_ids,
+        RegressionResult(np.asarray(y), predictions, weights, task_names), task_names)
+
+class CrossValidationResult(object):
+    """
+    Per fold RegressionResults, their mean and standard deviation per task, and
+    the pooled RegressionResult of all out of fold predictions.
+    """
+
+    def __init__(self, fold_results, fold_ids, pooled, task_names=None):
+        self.fold_results = fold_results
+        self.fold_ids = fold_ids
+        self.pooled = pooled
+        self.task_names = task_names
+        self.metrics = list(fold_results[0].results[0].keys())
+
+    def __getitem__(self, item):
+        """
+        Returns the (num_folds, num_tasks) values of metric item.
+        """
+        return np.array([result[item] for result in self.fold_results])
+
+    def summary(self):
+        """
+        Returns an OrderedDict of metric -> (mean, std) per task over folds.
+        """
+        return OrderedDict((metric, (self[metric].mean(axis=0), self[metric].std(axis=0)))
+                           for metric in self.metrics)
+
+    def __str__(self):
+        summary = self.summary()
+        num_tasks = len(self.fold_results[0].results)
+        lines = ['{} folds, mean +/- std over folds:'.format(len(self.fold_results))]
+        for task_index in range(num_tasks):
+            lines.append('{}{}'.format(
+                'Task {}: '.format(self.task_names[task_index] if self.task_names is not None
+                                   else task_index) if num_tasks > 1 else '',
+                '\t'.join('{}: {:.4f} +/- {:.4f}'.format(metric, mean[task_index], std[task_index])
+                          for metric, (mean, std) in summary.items())))
+        lines.append('Pooled out of fold predictions:')
+        lines.append(str(self.pooled))
+        return '\n'.join(lines)
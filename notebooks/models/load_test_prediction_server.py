@@ -0,0 +1,59 @@
+"""
+Load tests a running prediction_server.py: num_clients threads, each with its own
+connection, send requests of sequences_per_request random sequences for duration
+seconds. Reports throughput, latency percentiles and the server's mean batch size.
+
+Usage: python load_test_prediction_server.py [socket path | port] [num_clients]
+           [sequences_per_request] [duration] [seq_length]
+e.g.   python load_test_prediction_server.py /tmp/mpra_prediction.sock 32 1 10 145
+"""
+from __future__ import absolute_import, division, print_function
+import sys, threading, time, numpy as np
+from prediction_client import DEFAULT_SOCKET, PredictionClient
+
+def run_client(connect, num_sequences, seq_length, stop_time, seed, latencies):
+    rng = np.random.RandomState(seed)
+    with connect() as client:
+        while time.time() < stop_time:
+            seqs = [''.join(seq) for seq in np.array(list('ACGT'))[
+                rng.randint(4, size=(num_sequences, seq_length))]]
+            start = time.time()
+            client.predict(seqs)
+            latencies.append(time.time() - start)
+
+if __name__ == '__main__':
+    address = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOCKET
+    num_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    sequences_per_request = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    duration = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+    seq_length = int(sys.argv[5]) if len(sys.argv) > 5 else 145
+    connect = (lambda: PredictionClient(port=int(address))) if address.isdigit() else \
+        (lambda: PredictionClient(address))
+
+    with connect() as client:
+        stats_before = client.stats()
+    stop_time = time.time() + duration
+    latencies = [[] for _ in range(num_clients)]
+    threads = [threading.Thread(target=run_client, args=(
+                   connect, sequences_per_request, seq_length, stop_time, seed, latencies[seed]))
+               for seed in range(num_clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    with connect() as client:
+        stats_after = client.stats()
+
+    latencies = np.concatenate([np.array(client_latencies) for client_latencies in latencies]) * 1000
+    batches = stats_after.get('batches', 0) - stats_before.get('batches', 0)
+    sequences = stats_after.get('sequences', 0) - stats_before.get('sequences', 0)
+    print('{} clients x {} sequences per request for {:.1f} s'.format(
+        num_clients, sequences_per_request, elapsed))
+    print('Requests: {}\t{:.0f} requests/s\t{:.0f} sequences/s'.format(
+        len(latencies), len(latencies) / elapsed, len(latencies) * sequences_per_request / elapsed))
+    print('Latency (ms): median {:.1f}\t90% {:.1f}\t99% {:.1f}\tmax {:.1f}'.format(
+        *np.percentile(latencies, [50, 90, 99, 100])))
+    print('Server batches: {}\tmean batch size {:.1f} sequences'.format(
+        batches, sequences / max(batches, 1)))
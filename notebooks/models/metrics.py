@@ -1,11 +1,12 @@
 from __future__ import absolute_import, division, print_function
 import numpy as np
 from collections import OrderedDict
-from sklearn.metrics import auc, log_loss, precision_recall_curve, roc_auc_score, mean_squared_error, mean_absolute_error, median_absolute_error, r2_score
-from prg.prg import create_prg_curve, calc_auprg
+# sklearn and prg load on first use of the metrics that need them;
+# ClassificationResult needs neither.
 
 
 def loss(labels, predictions):
+    from sklearn.metrics import log_loss
     return log_loss(labels, predictions)
 
 
@@ -23,25 +24,190 @@ def balanced_accuracy(labels, predictions, threshold=0.5):
 
 
 def auROC(labels, predictions):
+    from sklearn.metrics import roc_auc_score
     return roc_auc_score(labels, predictions)
 
 
 def auPRC(labels, predictions):
+    from sklearn.metrics import auc, precision_recall_curve
     precision, recall = precision_recall_curve(labels, predictions)[:2]
     return auc(recall, precision)
 
 
 def auPRG(labels, predictions):
+    from prg.prg import create_prg_curve, calc_auprg
     return calc_auprg(create_prg_curve(labels, predictions))
 
 
 def recall_at_precision_threshold(labels, predictions, precision_threshold):
+    from sklearn.metrics import precision_recall_curve
     precision, recall = precision_recall_curve(labels, predictions)[:2]
     return 100 * recall[np.searchsorted(precision - precision_threshold, 0)]
 
+def _sorted_tasks(labels, predictions):
+    """
+    Yields, per task, the order sorting predictions in decreasing order, the
+    sorted labels and the position of the last of each run of tied predictions.
+    """
+    for task_labels, task_predictions in zip(labels.T, predictions.T):
+        order = np.argsort(-task_predictions, kind='mergesort')
+        sorted_predictions = task_predictions[order]
+        boundaries = np.append(np.flatnonzero(np.diff(sorted_predictions)), len(order) - 1)
+        yield order, task_labels[order].astype(bool), sorted_predictions, boundaries
+
+
+def _classification_metrics(labels, weights, sorted_predictions, boundaries, threshold):
+    """
+    Returns an OrderedDict of metric -> (num_resamples,) values for weights, a
+    num_resamples x N array of sample weights (e.g. bootstrap multiplicities) in
+    the order of the labels and of sorted_predictions, which decrease.
+
+    All metrics derive from the cumulative weight of positives and negatives
+    scoring at or above each distinct prediction, so the curves of every
+    resample share a single sort. Metrics of resamples without both classes are nan.
+    """
+    positives = np.cumsum(weights * labels, axis=1)
+    negatives = np.cumsum(weights, axis=1)
+    negatives -= positives
+    num_positives, num_negatives = positives[:, -1:], negatives[:, -1:]
+    # Curve points at each distinct threshold, after the (0, 0) point
+    ties = len(boundaries) < len(labels)
+    tp = np.hstack([np.zeros_like(num_positives), positives[:, boundaries] if ties else positives])
+    fp = np.hstack([np.zeros_like(num_negatives), negatives[:, boundaries] if ties else negatives])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Balanced accuracy: positives above and negatives below the threshold
+        num_above = np.searchsorted(-sorted_predictions, -threshold, side='left')
+        num_below = len(sorted_predictions) - np.searchsorted(-sorted_predictions, -threshold, side='right')
+        true_positives = positives[:, num_above - 1] if num_above else 0
+        true_negatives = num_negatives[:, 0] - (negatives[:, -num_below - 1] if num_below < len(labels) else 0)
+        balanced_accuracy = 50 * (true_positives / num_positives[:, 0] + true_negatives / num_negatives[:, 0])
+        tpr, fpr = tp / num_positives, fp / num_negatives
+        auROC = (np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2).sum(axis=1)
+        # Precision at thresholds no sample reaches is that of the (recall 0, precision 1) start
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1)
+        auPRC = (np.diff(tpr, axis=1) * (precision[:, 1:] + precision[:, :-1]) / 2).sum(axis=1)
+        recalls_at_fdr = [np.where(precision >= 1 - fdr, tpr, 0).max(axis=1) * 100 for fdr in (0.05, 0.1, 0.2)]
+        auPRG = _auPRG(tp, fp, num_positives, num_negatives)
+    invalid = (num_positives[:, 0] == 0) | (num_negatives[:, 0] == 0)
+    metrics = OrderedDict((
+        ('Balanced accuracy', balanced_accuracy),
+        ('auROC', auROC),
+        ('auPRC', auPRC),
+        ('auPRG', auPRG),
+        ('Recall at 5% FDR', recalls_at_fdr[0]),
+        ('Recall at 10% FDR', recalls_at_fdr[1]),
+        ('Recall at 20% FDR', recalls_at_fdr[2]),
+    ))
+    for values in metrics.values():
+        values[invalid] = np.nan
+    metrics['Num Positives'] = num_positives[:, 0]
+    metrics['Num Negatives'] = num_negatives[:, 0]
+    return metrics
+
+
+def _auPRG(tp, fp, num_positives, num_negatives):
+    """
+    Area under the precision recall gain curve of each row of the curve points
+    tp, fp, as calc_auprg(create_prg_curve(...)): the curve from where recall
+    gain crosses 0, with the crossing point interpolated in contingency space.
+    """
+    ratio = num_positives / num_negatives
+    recall_gain = 1 - ratio * (num_positives - tp) / tp
+    precision_gain = 1 - ratio * fp / tp
+    # The all positive point
+    everything = (tp == num_positives) & (fp == num_negatives)
+    recall_gain[everything], precision_gain[everything] = 1, 0
+    rows = np.arange(len(tp))
+    first = np.argmax(recall_gain >= 0, axis=1)
+    previous = np.maximum(first - 1, 0)
+    delta_tp = tp[rows, first] - tp[rows, previous]
+    alpha = np.where(delta_tp > 0, (num_positives[:, 0] ** 2 / (num_positives[:, 0] + num_negatives[:, 0]) -
+                                    tp[rows, previous]) / delta_tp, 0.5)
+    crossing_tp = tp[rows, previous] + alpha * delta_tp
+    crossing_fp = fp[rows, previous] + alpha * (fp[rows, first] - fp[rows, previous])
+    crossing_gain = 1 - ratio[:, 0] * crossing_fp / crossing_tp
+    # from the crossing point (0, crossing_gain), if it is not on the curve, to the first point
+    area = np.where(recall_gain[rows, first] > 0,
+                    recall_gain[rows, first] * (precision_gain[rows, first] + crossing_gain) / 2, 0)
+    segments = np.diff(recall_gain, axis=1) * (precision_gain[:, 1:] + precision_gain[:, :-1]) / 2
+    after_first = np.arange(segments.shape[1]) >= first[:, np.newaxis]
+    return area + np.where(after_first, segments, 0).sum(axis=1)
+
+
+class ClassificationResult(object):
+    """
+    Classification metrics per task of binary labels, e.g. elements thresholded
+    into active and inactive, and continuous predictions.
+
+    The predictions of each task are sorted once; ROC, PR and PRG curves all
+    derive from the cumulative counts of positives and negatives along that
+    order. Recall at x% FDR is the largest recall at a threshold with precision
+    of at least 1 - x.
+    """
+
+    def __init__(self, labels, predictions, sample_weight=None, task_names=None, threshold=0.5):
+        labels, predictions = np.asarray(labels), np.asarray(predictions)
+        if labels.ndim == 1:
+            labels, predictions = labels[:, np.newaxis], predictions[:, np.newaxis]
+        self.sample_weight = np.ones(len(labels)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        self.threshold = threshold
+        self.tasks = list(_sorted_tasks(labels, predictions))
+        self.results = [OrderedDict((metric, values[0]) for metric, values in _classification_metrics(
+            task_labels, self.sample_weight[np.newaxis, order], sorted_predictions, boundaries, threshold).items())
+            for order, task_labels, sorted_predictions, boundaries in self.tasks]
+        self.task_names = task_names
+        self.multitask = labels.shape[1] > 1
+
+    def bootstrap(self, num_bootstraps=1000, random_state=0, chunk_size=100):
+        """
+        Returns an OrderedDict of metric -> num_bootstraps x num_tasks array of its
+        values on bootstrap resamples of the samples, the same resamples for all
+        tasks. Resamples are drawn chunk_size at a time as multiplicity weights,
+        so no resample is re-sorted.
+        """
+        random_state = np.random.RandomState(random_state)
+        num_samples = len(self.sample_weight)
+        values = OrderedDict()
+        for start in range(0, num_bootstraps, chunk_size):
+            size = min(chunk_size, num_bootstraps - start)
+            draws = random_state.randint(num_samples, size=(size, num_samples)) + \
+                num_samples * np.arange(size)[:, np.newaxis]
+            weights = np.bincount(draws.ravel(), minlength=size * num_samples).reshape(
+                size, num_samples) * self.sample_weight
+            for task_index, (order, task_labels, sorted_predictions, boundaries) in enumerate(self.tasks):
+                for metric, metric_values in _classification_metrics(
+                        task_labels, weights[:, order], sorted_predictions, boundaries, self.threshold).items():
+                    values.setdefault(metric, np.empty((num_bootstraps, len(self.tasks))))[
+                        start:start + size, task_index] = metric_values
+        return values
+
+    def confidence_intervals(self, confidence=0.95, **bootstrap_kwargs):
+        """
+        Returns an OrderedDict of metric -> num_tasks x 2 array of percentile
+        bootstrap confidence interval bounds; see bootstrap.
+        """
+        tail = 50 * (1 - confidence)
+        return OrderedDict((metric, np.nanpercentile(values, [tail, 100 - tail], axis=0).T)
+                           for metric, values in self.bootstrap(**bootstrap_kwargs).items())
+
+    def __str__(self):
+        return '\n'.join(
+            '{}Balanced Accuracy: {:.2f}%\t auROC: {:.3f}\t auPRC: {:.3f}\t auPRG: {:.3f}\n\t'
+            'Recall at 5%|10%|20% FDR: {:.1f}%|{:.1f}%|{:.1f}%\t '
+            'Num Positives: {:g}\t Num Negatives: {:g}'.format(
+                '{}: '.format('Task {}'.format(
+                    self.task_names[task_index]
+                    if self.task_names is not None else task_index))
+                if self.multitask else '', *results.values())
+            for task_index, results in enumerate(self.results))
+
+    def __getitem__(self, item):
+        return np.array([task_results[item] for task_results in self.results])
+
 class RegressionResult(object):
 
     def __init__(self, labels, predictions, sample_weight=None, task_names=None):
+        from sklearn.metrics import mean_squared_error, mean_absolute_error, median_absolute_error, r2_score
         self.results = [OrderedDict((
             ('Mean Squared Error', mean_squared_error(task_labels, task_predictions, sample_weight=sample_weight)),
             ('Mean Absolute Error', mean_absolute_error(task_labels, task_predictions, sample_weight=sample_weight)),
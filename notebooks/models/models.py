@@ -1,18 +1,10 @@
 from __future__ import absolute_import, division, print_function
-import json, matplotlib, numpy as np, os, subprocess, tempfile
-matplotlib.use('pdf')
-import matplotlib.pyplot as plt
+import json, numpy as np, os, subprocess, tempfile
 from abc import abstractmethod, ABCMeta
 from metrics import RegressionResult
-from keras.models import Sequential
-from keras.callbacks import EarlyStopping
-from keras.layers.core import (
-    Activation, Dense, Dropout, Flatten,
-    Permute, Reshape, TimeDistributedDense
-)
-from keras.layers.convolutional import Convolution2D, MaxPooling2D
-from keras.layers.recurrent import GRU
-from keras.regularizers import l1
+from score_plots import render_scores
+# Keras loads when a model is built or loaded and matplotlib when scores are
+# plotted, so importing this module to predict with a saved model stays light.
 
 class Model(object):
     __metaclass__ = ABCMeta
@@ -25,16 +17,87 @@ class Model(object):
     def train(self, X, y, validation_data):
         pass
 
+    # Optional PredictionCache serving predict
+    prediction_cache = None
+
     @abstractmethod
-    def predict(self, X):
+    def _predict(self, X):
         pass
 
+    def predict(self, X):
+        if self.prediction_cache is not None:
+            return self.prediction_cache.predict(self._predict, X)
+        return self._predict(X)
+
     def test(self, X, y, sample_weight=None):
-        return RegressionResult(y, self.predict(X), sample_weight) 
+        # Always the current weights: cache keys do not identify the weights
+        return RegressionResult(y, self._predict(X), sample_weight) 
 
     def score(self, X, y, metric):
         return self.test(X, y)[metric]
 
+    def gradient_times_input(self, X, batch_size=200):
+        """
+        Returns (num_task, num_samples, 1, num_bases, sequence_length) gradient x input
+        score array, in the layout of deeplift.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        return self._gradients(X, batch_size) * X
+
+    def integrated_gradients(self, X, steps=20, reference=None, batch_size=200):
+        """
+        Returns (num_task, num_samples, 1, num_bases, sequence_length) integrated
+        gradients along the straight path from reference (default: all zeros, the
+        deeplift reference) to each sequence, as a steps point midpoint Riemann sum.
+        The interpolated inputs of batch_size // steps sequences are scored together.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        reference = np.zeros(X.shape[1:], dtype=np.float32) if reference is None else \
+            np.asarray(reference, dtype=np.float32)
+        alphas = ((np.arange(steps) + 0.5) / steps).astype(np.float32).reshape(
+            (steps,) + (1,) * (X.ndim - 1))
+        sequences_per_batch = max(1, batch_size // steps)
+        scores = np.empty((self.num_tasks,) + X.shape, dtype=np.float32)
+        for start in range(0, len(X), sequences_per_batch):
+            batch = X[start:start + sequences_per_batch]
+            # (sequences, steps, 1, num_bases, sequence_length)
+            interpolated = reference + alphas * (batch[:, np.newaxis] - reference)
+            gradients = self._gradients(interpolated.reshape((-1,) + X.shape[1:]), len(batch) * steps)
+            mean_gradients = gradients.reshape((self.num_tasks, len(batch), steps) + X.shape[1:]).mean(axis=2)
+            scores[:, start:start + len(batch)] = mean_gradients * (batch - reference)
+        return scores
+
+    def _gradients(self, X, batch_size):
+        """
+        Returns the (num_task,) + X.shape gradients of each task's output with
+        respect to X.
+        """
+        gradient_function, learning_phase = self._get_gradient_function()
+        gradients = np.empty((self.num_tasks,) + X.shape, dtype=np.float32)
+        for start in range(0, len(X), batch_size):
+            inputs = [X[start:start + batch_size]] + ([0] if learning_phase else [])
+            gradients[:, start:start + batch_size] = gradient_function(inputs)
+        return gradients
+
+    def _get_gradient_function(self):
+        # One backend function, compiled on first use, returns every task's
+        # gradients from a single forward and backward pass.
+        if getattr(self, '_gradient_function', None) is None:
+            from keras import backend as K
+            try:
+                inputs = self.model.get_input(train=False)
+                outputs = self.model.get_output(train=False)
+                learning_phase = False
+            except AttributeError:
+                inputs, outputs = self.model.input, self.model.output
+                learning_phase = True
+            gradients = [K.gradients(K.sum(outputs[:, task_index]), inputs)[0]
+                         for task_index in range(self.num_tasks)]
+            self._gradient_function = (
+                K.function([inputs] + ([K.learning_phase()] if learning_phase else []), gradients),
+                learning_phase)
+        return self._gradient_function
+
 class SequenceDNN_Regression(Model):
     """
     Sequence DNN models.
@@ -79,6 +142,11 @@ class SequenceDNN_Regression(Model):
             self.model = keras_model
             self.num_tasks = keras_model.layers[-1].output_shape[-1]
         elif seq_length is not None and keras_model is None:
+            from keras.models import Sequential
+            from keras.layers.core import Dense, Dropout, Flatten, Permute, Reshape, TimeDistributedDense
+            from keras.layers.convolutional import Convolution2D, MaxPooling2D
+            from keras.layers.recurrent import GRU
+            from keras.regularizers import l1
             self.model = Sequential()
             assert len(num_filters) == len(conv_width)
             for i, (nb_filter, nb_col) in enumerate(zip(num_filters, conv_width)):
@@ -104,7 +172,22 @@ class SequenceDNN_Regression(Model):
 
     def train(self, X, y, validation_data, early_stopping_metric='Mean Squared Error',
               early_stopping_patience=5, save_best_model_to_prefix=None,
-              train_sample_weight=None, valid_sample_weight=None):
+              train_sample_weight=None, valid_sample_weight=None, warm_start_prefix=None,
+              trained_keys=None):
+        """
+        Trains with early stopping. With warm_start_prefix, training starts from the
+        weights in <warm_start_prefix>.weights.h5 (saved from the same architecture)
+        instead of the random initialization, e.g. to fine tune on newly added
+        elements plus a replay sample of old ones (MrpaData.incremental_indices).
+        trained_keys, e.g. data.valid_keys, are saved with the best model as
+        <save_best_model_to_prefix>.keys.json, the baseline that later
+        incremental_indices calls count new elements against.
+        """
+        if warm_start_prefix is not None:
+            self.model.load_weights(warm_start_prefix + '.weights.h5')
+        # Predictions cached with other weights are stale from the first epoch on
+        if self.prediction_cache is not None:
+            self.prediction_cache.clear()
         if self.verbose >= 1:
             print('Training model (* indicates new best result)...')
         X_valid, y_valid = validation_data
@@ -128,7 +211,7 @@ class SequenceDNN_Regression(Model):
                 best_epoch = epoch
                 early_stopping_wait = 0
                 if save_best_model_to_prefix is not None:
-                    self.save(save_best_model_to_prefix)
+                    self.save(save_best_model_to_prefix, trained_keys)
             else:
                 if self.verbose >= 1:
                     print()
@@ -142,7 +225,7 @@ class SequenceDNN_Regression(Model):
                       'were saved to {1}.arch.json and {1}.weights.h5'.format(
                     best_epoch, save_best_model_to_prefix))
 
-    def predict(self, X):
+    def _predict(self, X):
         return self.model.predict(X, batch_size=128, verbose=False)
 
     def get_sequence_filters(self):
@@ -195,8 +278,8 @@ class SequenceDNN_Regression(Model):
             vertical_repeat = np.repeat(
                 np.arange(sequence.shape[-2]), sequence.shape[-1])
             mutated_sequences[arange, :, vertical_repeat, horizontal_cycle] = 1
-            # make mutant predictions
-            mutated_predictions = self.predict(mutated_sequences)
+            # make mutant predictions, bypassing the prediction cache
+            mutated_predictions = self._predict(mutated_sequences)
             mutated_predictions = mutated_predictions.reshape(
                 sequence.shape + (self.num_tasks,))
             mutagenesis_scores[
@@ -204,61 +287,41 @@ class SequenceDNN_Regression(Model):
         return np.rollaxis(mutagenesis_scores, -1)
 
     @staticmethod
-    def _plot_scores(X, output_directory, peak_width, score_func, score_name):
-        from dragonn.plot import plot_bases_on_ax
-        scores = score_func(X).squeeze(axis=2)  # (num_task, num_samples, num_bases, sequence_length)
-        try:
-            os.makedirs(output_directory)
-        except OSError:
-            pass
-        num_tasks = len(scores)
-        for task_index, task_scores in enumerate(scores):
-            for sequence_index, sequence_scores in enumerate(task_scores):
-                # sequence_scores is num_bases x sequence_length
-                basewise_max_sequence_scores = sequence_scores.max(axis=0)
-                plt.clf()
-                figure, (top_axis, bottom_axis) = plt.subplots(2)
-                top_axis.plot(range(1, len(basewise_max_sequence_scores) + 1),
-                              basewise_max_sequence_scores)
-                top_axis.set_title('{} scores (motif highlighted)'.format(score_name))
-                peak_position = basewise_max_sequence_scores.argmax()
-                top_axis.axvspan(peak_position - peak_width, peak_position + peak_width,
-                                 color='grey', alpha=0.1)
-                peak_sequence_scores = sequence_scores[:, peak_position - peak_width :
-                                                          peak_position + peak_width].T
-                # Set non-max letter_heights to zero
-                letter_heights = np.zeros_like(peak_sequence_scores)
-                letter_heights[np.arange(len(letter_heights)),
-                               peak_sequence_scores.argmax(axis=1)] = \
-                    basewise_max_sequence_scores[peak_position - peak_width :
-                                                 peak_position + peak_width]
-                plot_bases_on_ax(letter_heights, bottom_axis)
-                bottom_axis.set_xticklabels(tuple(map(
-                    str, np.arange(peak_position - peak_width, peak_position + peak_width + 1))))
-                bottom_axis.tick_params(axis='x', labelsize='small')
-                plt.xlabel('Position')
-                plt.ylabel('Score')
-                plt.savefig(os.path.join(output_directory, 'sequence_{}{}'.format(
-                    sequence_index, '_task_{}'.format(task_index) if num_tasks > 1 else '')))
-                plt.close()
-
-    def plot_deeplift(self, X, output_directory, peak_width=10):
-        self._plot_scores(X, output_directory, peak_width,
-                          score_func=self.deeplift, score_name='DeepLift')
-
-    def plot_in_silico_mutagenesis(self, X, output_directory, peak_width=10):
-        self._plot_scores(X, output_directory, peak_width,
-                          score_func=self.in_silico_mutagenesis, score_name='ISM')
+    def _plot_scores(X, output_directory, peak_width, score_func, score_name,
+                     scores=None, **render_kwargs):
+        """
+        Plots scores, computing them with score_func(X) unless precomputed scores
+        (num_task, num_samples, 1, num_bases, sequence_length) are given. See
+        score_plots.render_scores for output_format, processes, etc.
+        """
+        if scores is None:
+            scores = score_func(X)
+        return render_scores(scores.squeeze(axis=2), output_directory, score_name,
+                             peak_width, **render_kwargs)
+
+    def plot_deeplift(self, X, output_directory, peak_width=10, scores=None, **render_kwargs):
+        return self._plot_scores(X, output_directory, peak_width,
+                                 score_func=self.deeplift, score_name='DeepLift',
+                                 scores=scores, **render_kwargs)
+
+    def plot_in_silico_mutagenesis(self, X, output_directory, peak_width=10, scores=None,
+                                   **render_kwargs):
+        return self._plot_scores(X, output_directory, peak_width,
+                                 score_func=self.in_silico_mutagenesis, score_name='ISM',
+                                 scores=scores, **render_kwargs)
 
     def plot_architecture(self, output_file):
         from dragonn.visualize_util import plot as plot_keras_model
         plot_keras_model(self.model, output_file, show_shape=True)
 
-    def save(self, save_best_model_to_prefix):
+    def save(self, save_best_model_to_prefix, trained_keys=None):
         arch_fname = save_best_model_to_prefix + '.arch.json'
         weights_fname = save_best_model_to_prefix + '.weights.h5'
         open(arch_fname, 'w').write(self.model.to_json())
         self.model.save_weights(weights_fname, overwrite=True)
+        if trained_keys is not None:
+            with open(save_best_model_to_prefix + '.keys.json', 'w') as f:
+                json.dump(list(trained_keys), f)
 
     @staticmethod
     def load(arch_fname, weights_fname=None):
@@ -284,6 +347,10 @@ class Basset(Model):
             self.model = keras_model
             self.num_tasks = keras_model.layers[-1].output_shape[-1]
         elif seq_length is not None and keras_model is None:
+            from keras.models import Sequential
+            from keras.layers.core import Dense, Dropout, Flatten
+            from keras.layers.convolutional import Convolution2D, MaxPooling2D
+            from keras.regularizers import l1
             self.model = Sequential()
             assert len(num_filters) == len(conv_width)
             for i, (nb_filter, nb_col, pool, L) in enumerate(zip(num_filters, conv_width, pool_width, L1)):
@@ -303,7 +370,22 @@ class Basset(Model):
 
     def train(self, X, y, validation_data, early_stopping_metric='Mean Squared Error',
               early_stopping_patience=5, save_best_model_to_prefix=None,
-              train_sample_weight=None, valid_sample_weight=None):
+              train_sample_weight=None, valid_sample_weight=None, warm_start_prefix=None,
+              trained_keys=None):
+        """
+        Trains with early stopping. With warm_start_prefix, training starts from the
+        weights in <warm_start_prefix>.weights.h5 (saved from the same architecture)
+        instead of the random initialization, e.g. to fine tune on newly added
+        elements plus a replay sample of old ones (MrpaData.incremental_indices).
+        trained_keys, e.g. data.valid_keys, are saved with the best model as
+        <save_best_model_to_prefix>.keys.json, the baseline that later
+        incremental_indices calls count new elements against.
+        """
+        if warm_start_prefix is not None:
+            self.model.load_weights(warm_start_prefix + '.weights.h5')
+        # Predictions cached with other weights are stale from the first epoch on
+        if self.prediction_cache is not None:
+            self.prediction_cache.clear()
         if self.verbose >= 1:
             print('Training model (* indicates new best result)...')
         X_valid, y_valid = validation_data
@@ -327,7 +409,7 @@ class Basset(Model):
                 best_epoch = epoch
                 early_stopping_wait = 0
                 if save_best_model_to_prefix is not None:
-                    self.save(save_best_model_to_prefix)
+                    self.save(save_best_model_to_prefix, trained_keys)
             else:
                 if self.verbose >= 1:
                     print()
@@ -341,7 +423,7 @@ class Basset(Model):
                       'were saved to {1}.arch.json and {1}.weights.h5'.format(
                     best_epoch, save_best_model_to_prefix))
 
-    def predict(self, X):
+    def _predict(self, X):
         return self.model.predict(X, batch_size=128, verbose=False)
 
     def get_sequence_filters(self):
@@ -394,8 +476,8 @@ class Basset(Model):
             vertical_repeat = np.repeat(
                 np.arange(sequence.shape[-2]), sequence.shape[-1])
             mutated_sequences[arange, :, vertical_repeat, horizontal_cycle] = 1
-            # make mutant predictions
-            mutated_predictions = self.predict(mutated_sequences)
+            # make mutant predictions, bypassing the prediction cache
+            mutated_predictions = self._predict(mutated_sequences)
             mutated_predictions = mutated_predictions.reshape(
                 sequence.shape + (self.num_tasks,))
             mutagenesis_scores[
@@ -403,61 +485,41 @@ class Basset(Model):
         return np.rollaxis(mutagenesis_scores, -1)
 
     @staticmethod
-    def _plot_scores(X, output_directory, peak_width, score_func, score_name):
-        from dragonn.plot import plot_bases_on_ax
-        scores = score_func(X).squeeze(axis=2)  # (num_task, num_samples, num_bases, sequence_length)
-        try:
-            os.makedirs(output_directory)
-        except OSError:
-            pass
-        num_tasks = len(scores)
-        for task_index, task_scores in enumerate(scores):
-            for sequence_index, sequence_scores in enumerate(task_scores):
-                # sequence_scores is num_bases x sequence_length
-                basewise_max_sequence_scores = sequence_scores.max(axis=0)
-                plt.clf()
-                figure, (top_axis, bottom_axis) = plt.subplots(2)
-                top_axis.plot(range(1, len(basewise_max_sequence_scores) + 1),
-                              basewise_max_sequence_scores)
-                top_axis.set_title('{} scores (motif highlighted)'.format(score_name))
-                peak_position = basewise_max_sequence_scores.argmax()
-                top_axis.axvspan(peak_position - peak_width, peak_position + peak_width,
-                                 color='grey', alpha=0.1)
-                peak_sequence_scores = sequence_scores[:, peak_position - peak_width :
-                                                          peak_position + peak_width].T
-                # Set non-max letter_heights to zero
-                letter_heights = np.zeros_like(peak_sequence_scores)
-                letter_heights[np.arange(len(letter_heights)),
-                               peak_sequence_scores.argmax(axis=1)] = \
-                    basewise_max_sequence_scores[peak_position - peak_width :
-                                                 peak_position + peak_width]
-                plot_bases_on_ax(letter_heights, bottom_axis)
-                bottom_axis.set_xticklabels(tuple(map(
-                    str, np.arange(peak_position - peak_width, peak_position + peak_width + 1))))
-                bottom_axis.tick_params(axis='x', labelsize='small')
-                plt.xlabel('Position')
-                plt.ylabel('Score')
-                plt.savefig(os.path.join(output_directory, 'sequence_{}{}'.format(
-                    sequence_index, '_task_{}'.format(task_index) if num_tasks > 1 else '')))
-                plt.close()
-
-    def plot_deeplift(self, X, output_directory, peak_width=10):
-        self._plot_scores(X, output_directory, peak_width,
-                          score_func=self.deeplift, score_name='DeepLift')
-
-    def plot_in_silico_mutagenesis(self, X, output_directory, peak_width=10):
-        self._plot_scores(X, output_directory, peak_width,
-                          score_func=self.in_silico_mutagenesis, score_name='ISM')
+    def _plot_scores(X, output_directory, peak_width, score_func, score_name,
+                     scores=None, **render_kwargs):
+        """
+        Plots scores, computing them with score_func(X) unless precomputed scores
+        (num_task, num_samples, 1, num_bases, sequence_length) are given. See
+        score_plots.render_scores for output_format, processes, etc.
+        """
+        if scores is None:
+            scores = score_func(X)
+        return render_scores(scores.squeeze(axis=2), output_directory, score_name,
+                             peak_width, **render_kwargs)
+
+    def plot_deeplift(self, X, output_directory, peak_width=10, scores=None, **render_kwargs):
+        return self._plot_scores(X, output_directory, peak_width,
+                                 score_func=self.deeplift, score_name='DeepLift',
+                                 scores=scores, **render_kwargs)
+
+    def plot_in_silico_mutagenesis(self, X, output_directory, peak_width=10, scores=None,
+                                   **render_kwargs):
+        return self._plot_scores(X, output_directory, peak_width,
+                                 score_func=self.in_silico_mutagenesis, score_name='ISM',
+                                 scores=scores, **render_kwargs)
 
     def plot_architecture(self, output_file):
         from dragonn.visualize_util import plot as plot_keras_model
         plot_keras_model(self.model, output_file, show_shape=True)
 
-    def save(self, save_best_model_to_prefix):
+    def save(self, save_best_model_to_prefix, trained_keys=None):
         arch_fname = save_best_model_to_prefix + '.arch.json'
         weights_fname = save_best_model_to_prefix + '.weights.h5'
         open(arch_fname, 'w').write(self.model.to_json())
         self.model.save_weights(weights_fname, overwrite=True)
+        if trained_keys is not None:
+            with open(save_best_model_to_prefix + '.keys.json', 'w') as f:
+                json.dump(list(trained_keys), f)
 
     @staticmethod
     def load(arch_fname, weights_fname=None):
@@ -0,0 +1,290 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from collections import OrderedDict
+
+# Row order of the one hot encoding used throughout (see MrpaData.bases)
+bases = ['A', 'T', 'C', 'G']
+_complement = [bases.index(base) for base in ['T', 'A', 'G', 'C']]
+
+def model_filters(model):
+    """
+    Returns (filters, biases) of the first convolution layer of a
+    SequenceDNN_Regression or Basset model; filters are (num_filters, num_bases,
+    filter_length) as returned by get_sequence_filters.
+    """
+    weights, biases = model.model.layers[0].get_weights()[:2]
+    return weights.squeeze(axis=1), biases
+
+def _position_weights(filters, flip_kernels=True):
+    # Theano's conv2d is a true convolution, so the weights applied to the one
+    # hot input are the stored kernels flipped along both axes.
+    filters = np.asarray(filters, dtype=np.float32)
+    if flip_kernels:
+        filters = filters[:, ::-1, ::-1]
+    return np.ascontiguousarray(filters.transpose(2, 1, 0))  # (filter_length, num_bases, num_filters)
+
+def filter_pwms(filters, flip_kernels=True):
+    """
+    Returns (num_filters, filter_length, num_bases) position weight matrices, the
+    softmax over bases of each filter position, in the orientation the filters are
+    applied to sequences.
+    """
+    weights = _position_weights(filters, flip_kernels).transpose(2, 0, 1).astype(np.float64)
+    weights = np.exp(weights - weights.max(axis=-1, keepdims=True))
+    return weights / weights.sum(axis=-1, keepdims=True)
+
+def reverse_complement_pwms(pwms):
+    return pwms[..., ::-1, :][..., _complement]
+
+def scan_batches(codes, filters, biases=None, batch_size=4096, flip_kernels=True):
+    """
+    Scores every filter at every position of each sequence, one batch at a time.
+
+    Since the input is one hot, the convolution at each filter offset is a lookup
+    of the filter column by base code, so no one hot tensor is built.
+
+    Parameters
+    ----------
+    codes : np.array
+        N x seq_length uint8 base codes, e.g. MrpaData.seq_codes. Only one batch
+        at a time is read, so memmaps and strided views work.
+    filters : np.array
+        (num_filters, num_bases, filter_length), e.g. from get_sequence_filters.
+    biases : np.array, optional
+        (num_filters,) biases added to the scores.
+
+    Yields
+    ------
+    (start, scores) with scores the float32 (batch, num_filters, seq_length -
+    filter_length + 1) pre-activation scores of codes[start:start + batch].
+    """
+    weights = _position_weights(filters, flip_kernels)
+    for start in range(0, len(codes), batch_size):
+        yield start, _scan(np.asarray(codes[start:start + batch_size]), weights, biases)
+
+def _scan(codes, weights, biases):
+    filter_length = len(weights)
+    num_positions = codes.shape[1] - filter_length + 1
+    scores = np.zeros((len(codes), num_positions, weights.shape[-1]), dtype=np.float32)
+    for offset in range(filter_length):
+        scores += weights[offset][codes[:, offset:offset + num_positions]]
+    if biases is not None:
+        scores += np.asarray(biases, dtype=np.float32)
+    return scores.transpose(0, 2, 1)
+
+def max_scores(codes, filters, biases=None, batch_size=4096, flip_kernels=True):
+    """
+    Returns (max_score, max_position): the N x num_filters best score of each
+    filter in each sequence and where it occurs.
+    """
+    num_filters = len(filters)
+    best = np.empty((len(codes), num_filters), dtype=np.float32)
+    position = np.empty((len(codes), num_filters), dtype=np.int64)
+    for start, scores in scan_batches(codes, filters, biases, batch_size, flip_kernels):
+        best[start:start + len(scores)] = scores.max(axis=-1)
+        position[start:start + len(scores)] = scores.argmax(axis=-1)
+    return best, position
+
+def read_meme(path):
+    """
+    Reads a MEME format motif database such as JASPAR's. Returns (names, pwms)
+    with each pwm a motif_length x num_bases array with columns ordered as bases.
+    """
+    names, pwms = [], []
+    alphabet = 'ACGT'
+    with open(path) as f:
+        lines = iter(f)
+        for line in lines:
+            if line.startswith('ALPHABET='):
+                alphabet = line.split('=', 1)[1].strip()
+            elif line.startswith('MOTIF'):
+                names.append(' '.join(line.split()[1:]))
+            elif line.startswith('letter-probability matrix'):
+                fields = line.split(':', 1)[1].replace('= ', '=').split()
+                motif_length = int(dict(field.split('=') for field in fields)['w'])
+                rows = []
+                while len(rows) < motif_length:
+                    row = next(lines).split()
+                    if row:
+                        rows.append(row)
+                pwms.append(np.array(rows, dtype=np.float64))
+    order = [alphabet.index(base) for base in bases]
+    return names, [pwm[:, order] for pwm in pwms]
+
+def _standardized_columns(pwms, motif_length):
+    # Pads to motif_length and centers / scales each column to unit norm, so the
+    # dot product of two columns is their Pearson correlation. Padding is 0.
+    padded = np.zeros((len(pwms), motif_length, len(bases)))
+    for i, pwm in enumerate(pwms):
+        columns = pwm - pwm.mean(axis=-1, keepdims=True)
+        norms = np.sqrt((columns ** 2).sum(axis=-1, keepdims=True))
+        padded[i, :len(pwm)] = columns / np.where(norms > 0, norms, 1)
+    return padded
+
+def motif_similarity(query_pwms, target_pwms, min_overlap=5, chunk_size=256):
+    """
+    Compares every query motif (e.g. filter_pwms) to every target motif (e.g.
+    from read_meme) on both strands at every offset with at least min_overlap
+    aligned columns. The similarity of an alignment is the mean Pearson
+    correlation of the aligned columns.
+
+    Returns
+    -------
+    (similarity, offset, reverse): num_queries x num_targets arrays of the best
+    similarity, the target start relative to the query start, and whether the
+    best match is to the target's reverse complement.
+    """
+    query_lengths = np.array([len(pwm) for pwm in query_pwms])
+    query_length = query_lengths.max()
+    queries = _standardized_columns(query_pwms, query_length)
+    similarity = np.full((len(query_pwms), len(target_pwms)), -np.inf)
+    best_offset = np.zeros(similarity.shape, dtype=np.int64)
+    reverse = np.zeros(similarity.shape, dtype=bool)
+    for start in range(0, len(target_pwms), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        target_lengths = np.array([len(pwm) for pwm in target_pwms[chunk]])
+        target_length = target_lengths.max()
+        for is_reverse in (False, True):
+            targets = _standardized_columns(
+                [reverse_complement_pwms(pwm) if is_reverse else pwm for pwm in target_pwms[chunk]],
+                target_length)
+            # (queries, targets, query column, target column) column correlations
+            columns = np.einsum('qib,tjb->qtij', queries, targets)
+            for offset in range(-query_length + 1, target_length):
+                # Query column i is aligned to target column i + offset.
+                total = np.trace(columns, offset=offset, axis1=2, axis2=3)
+                overlap = (np.minimum(query_lengths[:, np.newaxis], target_lengths - offset) -
+                           np.maximum(0, -offset))
+                score = np.where(overlap >= min_overlap, total / np.maximum(overlap, 1), -np.inf)
+                better = score > similarity[:, chunk]
+                similarity[:, chunk] = np.where(better, score, similarity[:, chunk])
+                best_offset[:, chunk] = np.where(better, offset, best_offset[:, chunk])
+                reverse[:, chunk] = np.where(better, is_reverse, reverse[:, chunk])
+    return similarity, best_offset, reverse
+
+def match_filters(filters, motif_names, motif_pwms, top=5, min_overlap=5, flip_kernels=True):
+    """
+    Returns, for each filter, a list of its top (motif name, similarity, offset,
+    reverse) matches in a motif database.
+    """
+    similarity, offset, reverse = motif_similarity(
+        filter_pwms(filters, flip_kernels), motif_pwms, min_overlap)
+    order = np.argsort(-similarity, axis=1)[:, :top]
+    return [[(motif_names[j], similarity[i, j], offset[i, j], reverse[i, j]) for j in row]
+            for i, row in enumerate(order)]
+
+class FilterActivationStats(object):
+    """
+    Running per filter statistics of ReLU activations over sequences, without
+    keeping the activations: the mean and variance of each sequence's maximum,
+    the fraction of sequences activating it, the mean activation at each position
+    and the base counts of windows scoring above threshold_fraction of the
+    filter's maximum possible score, from which activation_pwms are derived.
+    Accumulators over disjoint sequences can be merged.
+    """
+
+    def __init__(self, filters, biases=None, threshold_fraction=0.5, flip_kernels=True):
+        self.weights = _position_weights(filters, flip_kernels)
+        self.biases = np.zeros(len(filters), dtype=np.float32) if biases is None else \
+            np.asarray(biases, dtype=np.float32)
+        filter_length, num_bases, num_filters = self.weights.shape
+        # At least 0, so filters that can never activate count no windows
+        self.thresholds = np.maximum(
+            threshold_fraction * (self.weights.max(axis=1).sum(axis=0) + self.biases), 0)
+        self.count = 0
+        self.sum_max = np.zeros(num_filters)
+        self.sum_squares_max = np.zeros(num_filters)
+        self.active = np.zeros(num_filters, dtype=np.int64)
+        self.above = np.zeros(num_filters, dtype=np.int64)
+        self.position_sum = 0
+        self.base_counts = np.zeros((num_filters, filter_length, num_bases), dtype=np.int64)
+
+    def update(self, codes):
+        codes = np.asarray(codes)
+        activations = np.maximum(_scan(codes, self.weights, self.biases), 0)
+        best = activations.max(axis=-1).astype(np.float64)
+        self.count += len(codes)
+        self.sum_max += best.sum(axis=0)
+        self.sum_squares_max += (best ** 2).sum(axis=0)
+        self.active += (best > 0).sum(axis=0)
+        self.position_sum = self.position_sum + activations.sum(axis=0, dtype=np.float64)
+        sequence, filter_index, position = np.nonzero(activations > self.thresholds[:, np.newaxis])
+        self.above += np.bincount(filter_index, minlength=len(self.above))
+        filter_length, num_bases = self.base_counts.shape[1:]
+        for offset in range(filter_length):
+            bins = (filter_index * filter_length + offset) * num_bases + codes[sequence, position + offset]
+            self.base_counts += np.bincount(bins, minlength=self.base_counts.size).reshape(
+                self.base_counts.shape)
+
+    def merge(self, other):
+        for attribute in ('count', 'sum_max', 'sum_squares_max', 'active', 'above',
+                          'position_sum', 'base_counts'):
+            setattr(self, attribute, getattr(self, attribute) + getattr(other, attribute))
+        return self
+
+    def mean_max(self):
+        return self.sum_max / self.count
+
+    def variance_max(self):
+        return self.sum_squares_max / self.count - self.mean_max() ** 2
+
+    def fraction_active(self):
+        return self.active / self.count
+
+    def mean_position_activation(self):
+        """
+        Returns the (num_filters, num_positions) mean activation at each position.
+        """
+        return self.position_sum / self.count
+
+    def activation_pwms(self, pseudocount=0.5):
+        """
+        Returns (num_filters, filter_length, num_bases) PWMs of the windows that
+        activated each filter above threshold.
+        """
+        counts = self.base_counts + pseudocount
+        return counts / counts.sum(axis=-1, keepdims=True)
+
+    def report(self):
+        """
+        Returns an OrderedDict of per filter arrays.
+        """
+        return OrderedDict((
+            ('mean_max', self.mean_max()),
+            ('std_max', np.sqrt(np.maximum(self.variance_max(), 0))),
+            ('fraction_active', self.fraction_active()),
+            ('windows_above_threshold', self.above),
+            ('mean_activation', self.mean_position_activation().mean(axis=-1)),
+        ))
+
+    def __str__(self):
+        return '\n'.join(
+            'Filter {}: Mean Max Activation: {:.4f}\tStd Max Activation: {:.4f}\t'
+            'Fraction Active: {:.4f}\tWindows Above Threshold: {}\tMean Activation: {:.4f}'.format(
+                filter_index, *values)
+            for filter_index, values in enumerate(zip(*self.report().values())))
+
+def filter_activation_stats(filters, data, biases=None, chunk_size=10000, keys=None, **kwargs):
+    """
+    Streams the sequences of an MrpaData (or PilotData) set through the filters
+    chunk_size sequences at a time.
+
+    Parameters
+    ----------
+    data : MrpaData
+        sequences are read from data.seq_codes.
+    keys : list, optional
+        element keys to use. Default: data.valid_keys.
+    kwargs
+        threshold_fraction and flip_kernels of the FilterActivationStats.
+
+    Returns
+    -------
+    FilterActivationStats
+    """
+    keys = data.valid_keys if keys is None else keys
+    rows = np.array([data.seq_index[key] for key in keys], dtype=np.int64)
+    stats = FilterActivationStats(filters, biases, **kwargs)
+    for start in range(0, len(rows), chunk_size):
+        stats.update(data.seq_codes[rows[start:start + chunk_size]])
+    return stats
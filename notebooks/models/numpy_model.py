@@ -0,0 +1,394 @@
+from __future__ import absolute_import, division, print_function
+import json, numpy as np
+from collections import OrderedDict
+from functools import partial
+from numpy.lib.stride_tricks import as_strided
+
+_activations = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+}
+
+class NumpyModel(object):
+    """
+    Keras free forward pass of the convolution / ReLU / max pooling / dense stacks
+    built by SequenceDNN_Regression and Basset, read from their saved
+    .arch.json and .weights.h5 (Keras 0.3, Theano dim ordering).
+
+    Activations are kept channels last, (samples, rows, columns, channels), so
+    each convolution is an im2col copy of strided patches followed by a single
+    float32 matrix multiply. Dropout is the identity at inference.
+
+    Parameters
+    ----------
+    layers : list[dict]
+        one dict per layer with its 'name', configuration and weights, as built
+        by load.
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+        self.input_shape = tuple(layers[0].get('input_shape', ()))
+        self.num_tasks = [layer for layer in layers if layer['name'] == 'Dense'][-1]['b'].shape[0]
+
+    @staticmethod
+    def load(arch_fname, weights_fname, flip_kernels=True):
+        """
+        Reads a model saved by SequenceDNN_Regression.save or Basset.save.
+
+        Theano's conv2d is a true convolution, so kernels are flipped to be applied
+        as correlations; flip_kernels=False is for weights trained with a
+        correlating backend.
+        """
+        import h5py
+        with open(arch_fname) as f:
+            config = json.load(f)
+        layers = []
+        with h5py.File(weights_fname, 'r') as weights_file:
+            for layer_index, layer_config in enumerate(config['layers']):
+                group = weights_file['layer_{}'.format(layer_index)]
+                params = [group['param_{}'.format(i)][()] for i in range(group.attrs['nb_params'])]
+                layers.append(_build_layer(layer_config, params, flip_kernels))
+        return NumpyModel(layers)
+
+    def save(self, fname):
+        """
+        Exports the model to a single .npz that load_exported reads without h5py.
+        """
+        arrays = {}
+        specs = []
+        for layer_index, layer in enumerate(self.layers):
+            spec = {}
+            for key, value in layer.items():
+                if isinstance(value, np.ndarray):
+                    arrays['{}_{}'.format(layer_index, key)] = value
+                else:
+                    spec[key] = value
+            specs.append(spec)
+        np.savez(fname, layers=np.array(json.dumps(specs)), **arrays)
+
+    @staticmethod
+    def load_exported(fname):
+        with np.load(fname) as arrays:
+            layers = json.loads(str(arrays['layers']))
+            for layer_index, layer in enumerate(layers):
+                prefix = '{}_'.format(layer_index)
+                layer.update((name[len(prefix):], arrays[name])
+                             for name in arrays.files if name.startswith(prefix))
+        return (QuantizedModel if 'table' in layers[0] else NumpyModel)(layers)
+
+    def quantize(self, weight_dtype='float16'):
+        """
+        Returns a QuantizedModel of this model with weight_dtype ('float16' or
+        'int8') weights after the first layer.
+        """
+        if weight_dtype not in ('float16', 'int8'):
+            raise ValueError("weight_dtype must be 'float16' or 'int8'")
+        first = self.layers[0]
+        num_channels, num_bases = self.input_shape[:2]
+        if first['name'] != 'Convolution2D' or num_channels != 1 or first['kernel_shape'][0] != num_bases:
+            raise ValueError("The first layer must be a convolution spanning all bases.")
+        filter_length = first['kernel_shape'][1]
+        table = first['kernel'].reshape(num_bases, filter_length, -1).transpose(1, 0, 2)
+        # Extra all zero row for unknown (all zero) input columns
+        table = np.concatenate([table, np.zeros_like(table[:, :1])], axis=1)
+        first = {key: value for key, value in first.items() if key != 'kernel'}
+        first['table'] = np.ascontiguousarray(table)
+        return QuantizedModel([first] + [_quantize_layer(layer, weight_dtype)
+                                         for layer in self.layers[1:]])
+
+    # Optional PredictionCache serving predict
+    prediction_cache = None
+
+    def predict(self, X, batch_size=128):
+        """
+        Returns (num_samples, num_tasks) float32 predictions for one hot X of shape
+        (num_samples, 1, num_bases, sequence_length).
+        """
+        if self.prediction_cache is not None:
+            return self.prediction_cache.predict(partial(self._predict, batch_size=batch_size), X)
+        return self._predict(X, batch_size)
+
+    def _predict(self, X, batch_size=128):
+        X = np.asarray(X)
+        predictions = np.empty((len(X), self.num_tasks), dtype=np.float32)
+        for start in range(0, len(X), batch_size):
+            predictions[start:start + batch_size] = self._forward(X[start:start + batch_size])
+        return predictions
+
+    def in_silico_mutagenesis(self, X, batch_size=128):
+        """
+        Returns (num_task, num_samples, 1, num_bases, sequence_length) ISM score array,
+        like SequenceDNN_Regression.in_silico_mutagenesis.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        num_bases, sequence_length = X.shape[-2:]
+        mutagenesis_scores = np.empty(X.shape + (self.num_tasks,), dtype=np.float32)
+        wild_type_predictions = self.predict(X, batch_size)
+        base, position = np.divmod(np.arange(num_bases * sequence_length), sequence_length)
+        for sequence_index, sequence in enumerate(X):
+            mutated_sequences = np.repeat(sequence[np.newaxis], len(base), axis=0)
+            mutated_sequences[np.arange(len(base)), :, :, position] = 0
+            mutated_sequences[np.arange(len(base)), :, base, position] = 1
+            mutated_predictions = self._predict(mutated_sequences, batch_size)
+            mutagenesis_scores[sequence_index] = (
+                wild_type_predictions[sequence_index] -
+                mutated_predictions.reshape(sequence.shape + (self.num_tasks,)))
+        return np.rollaxis(mutagenesis_scores, -1)
+
+    def _forward(self, X):
+        # (samples, channels, rows, columns) -> channels last
+        output = np.ascontiguousarray(np.asarray(X, dtype=np.float32).transpose(0, 2, 3, 1))
+        for layer in self.layers:
+            output = _forward_layer(layer, output)
+        return output
+
+class QuantizedModel(NumpyModel):
+    """
+    NumpyModel for saturation mutagenesis, built by NumpyModel.quantize.
+
+    Quantization targets in_silico_mutagenesis only. Its first convolution runs
+    on base codes rather than one hot input: its output at each position is a
+    sum of filter_length lookups in a (filter_length, num_bases + 1,
+    num_filters) table, with no multiplies, and only the outputs of the leading
+    convolutions whose receptive field covers the mutated base are recomputed.
+
+    Later layers are stored with float16 or int8 (per output unit scaled)
+    weights, which shrink the exported model. NumPy has no float16 or int8
+    matrix multiply, so they are expanded to float32 once, in float_model, and
+    predict runs the float32 NumpyModel forward pass of float_model.
+    """
+
+    def __init__(self, layers):
+        super(QuantizedModel, self).__init__(layers)
+        # Leading layers that are local along the sequence, and their receptive field
+        self.num_local_layers = 1
+        self.receptive_field = len(layers[0]['table'])
+        for layer in layers[1:]:
+            if layer['name'] not in ('Convolution2D', 'Dropout', 'Activation'):
+                break
+            if layer['name'] == 'Convolution2D':
+                self.receptive_field += layer['kernel_shape'][1] - 1
+            self.num_local_layers += 1
+        first = layers[0]
+        table = first['table']
+        num_bases = table.shape[1] - 1
+        float_first = {key: value for key, value in first.items() if key != 'table'}
+        float_first['kernel'] = np.ascontiguousarray(
+            table[:, :num_bases].transpose(1, 0, 2).reshape(-1, table.shape[-1]))
+        self.float_model = NumpyModel([float_first] + [_expand_layer(layer) for layer in layers[1:]])
+
+    def predict_codes(self, codes, batch_size=128):
+        """
+        Returns (num_samples, num_tasks) float32 predictions for a num_samples x
+        sequence_length array of base codes, e.g. MrpaData.seq_codes, one hot
+        encoded a batch at a time for the float32 forward pass.
+        """
+        num_bases = self.layers[0]['table'].shape[1] - 1
+        predictions = np.empty((len(codes), self.num_tasks), dtype=np.float32)
+        for start in range(0, len(codes), batch_size):
+            batch = np.asarray(codes[start:start + batch_size])
+            predictions[start:start + batch_size] = self._forward(
+                (batch[:, np.newaxis, np.newaxis] == np.arange(num_bases)[:, np.newaxis]).astype(np.float32))
+        return predictions
+
+    def in_silico_mutagenesis(self, X, batch_size=128):
+        codes = _codes(X)
+        num_bases, sequence_length = np.shape(X)[-2:]
+        span = self.receptive_field - 1
+        mutagenesis_scores = np.empty(
+            (len(codes), 1, num_bases, sequence_length, self.num_tasks), dtype=np.float32)
+        base, position = np.divmod(np.arange(num_bases * sequence_length), sequence_length)
+        # Local output q of a mutant at position p is wild type output p - span + q
+        output_position = position[:, np.newaxis] - span + np.arange(span + 1)
+        padding = np.full(span, num_bases, dtype=np.uint8)
+        for sequence_index, sequence_codes in enumerate(codes):
+            wild_type = self._local_forward(sequence_codes[np.newaxis])
+            wild_type_prediction = self._global_forward(wild_type)[0]
+            valid = (output_position >= 0) & (output_position < wild_type.shape[2])
+            padded = np.concatenate([padding, sequence_codes, padding])
+            mutated_predictions = np.empty((len(base), self.num_tasks), dtype=np.float32)
+            for start in range(0, len(base), batch_size):
+                batch = slice(start, start + batch_size)
+                # Mutated bases and everything within span of them
+                windows = padded[position[batch, np.newaxis] + np.arange(2 * span + 1)]
+                windows[:, span] = base[batch]
+                local = self._local_forward(windows)
+                mutated = np.repeat(wild_type, len(windows), axis=0)
+                mutant, offset = np.nonzero(valid[batch])
+                mutated[mutant, :, output_position[batch][mutant, offset]] = local[mutant, :, offset]
+                mutated_predictions[batch] = self._global_forward(mutated)
+            mutagenesis_scores[sequence_index] = (
+                wild_type_prediction -
+                mutated_predictions.reshape(1, num_bases, sequence_length, self.num_tasks))
+        return np.rollaxis(mutagenesis_scores, -1)
+
+    def _forward(self, X):
+        return self.float_model._forward(X)
+
+    def _local_forward(self, codes):
+        first = self.layers[0]
+        table = first['table']
+        filter_length = len(table)
+        num_positions = codes.shape[1] - filter_length + 1
+        output = np.zeros((len(codes), 1, num_positions, table.shape[-1]), dtype=np.float32)
+        for offset in range(filter_length):
+            output[:, 0] += table[offset][codes[:, offset:offset + num_positions]]
+        output += first['b']
+        output = _activations[first['activation']](output)
+        for layer in self.float_model.layers[1:self.num_local_layers]:
+            output = _forward_layer(layer, output)
+        return output
+
+    def _global_forward(self, output):
+        for layer in self.float_model.layers[self.num_local_layers:]:
+            output = _forward_layer(layer, output)
+        return output
+
+def calibrate(model, quantized_model, data, indices=None, holdout_fraction=0.1,
+              random_state=42, batch_size=128):
+    """
+    Compares a QuantizedModel to the float32 model it came from on held out
+    elements of an MrpaData set.
+
+    Parameters
+    ----------
+    indices : np.array, optional
+        indices into data.valid_keys to use. Default: a random holdout_fraction.
+
+    Returns
+    -------
+    OrderedDict of RegressionResults: 'agreement' of the quantized with the
+    float32 predictions, and when the model's tasks match data.y_multitask(),
+    'float32' and 'quantized' of each against the measurements.
+    """
+    from metrics import RegressionResult
+    if indices is None:
+        indices = np.sort(np.random.RandomState(random_state).choice(
+            len(data.valid_keys), int(round(holdout_fraction * len(data.valid_keys))), replace=False))
+    X = data.X_one_hot()[indices]
+    predictions = model.predict(X, batch_size)
+    quantized_predictions = quantized_model.predict(X, batch_size)
+    results = OrderedDict([('agreement', RegressionResult(predictions, quantized_predictions))])
+    y = data.y_multitask()[indices]
+    if y.shape[1] == model.num_tasks:
+        task_names = ['{} {}'.format(*key) for key in data._experiment_keys()]
+        results['float32'] = RegressionResult(y, predictions, task_names=task_names)
+        results['quantized'] = RegressionResult(y, quantized_predictions, task_names=task_names)
+    return results
+
+def _build_layer(config, params, flip_kernels):
+    name = config['name']
+    layer = {'name': name}
+    if 'input_shape' in config:
+        layer['input_shape'] = list(config['input_shape'])
+    if name == 'Convolution2D':
+        if config.get('border_mode', 'valid') != 'valid' or tuple(config.get('subsample', (1, 1))) != (1, 1):
+            raise ValueError("Only valid, unit stride convolutions are supported.")
+        W, b = params
+        if flip_kernels:
+            W = W[:, :, ::-1, ::-1]
+        # (filters, channels, rows, columns) -> (rows * columns * channels, filters)
+        layer['kernel'] = np.ascontiguousarray(
+            W.transpose(2, 3, 1, 0).reshape(-1, W.shape[0]), dtype=np.float32)
+        layer['kernel_shape'] = list(W.shape[2:])
+        layer['b'] = np.asarray(b, dtype=np.float32)
+        layer['activation'] = config.get('activation', 'linear')
+    elif name == 'Dense':
+        W, b = params
+        layer['W'] = np.asarray(W, dtype=np.float32)
+        layer['b'] = np.asarray(b, dtype=np.float32)
+        layer['activation'] = config.get('activation', 'linear')
+    elif name == 'MaxPooling2D':
+        if config.get('border_mode', 'valid') != 'valid':
+            raise ValueError("Only valid max pooling is supported.")
+        layer['pool_size'] = list(config['pool_size'])
+        layer['strides'] = list(config.get('strides') or config['pool_size'])
+    elif name == 'Activation':
+        layer['activation'] = config['activation']
+    elif name not in ('Dropout', 'Flatten'):
+        raise ValueError("Unsupported layer: {}".format(name))
+    if layer.get('activation', 'linear') not in _activations:
+        raise ValueError("Unsupported activation: {}".format(layer['activation']))
+    return layer
+
+def _forward_layer(layer, X):
+    name = layer['name']
+    if name == 'Convolution2D':
+        return _activations[layer['activation']](
+            _conv(X, layer['kernel'], layer['kernel_shape'], layer['b']))
+    if name == 'MaxPooling2D':
+        return _max_pool(X, layer['pool_size'], layer['strides'])
+    if name == 'Flatten':
+        # Theano flattens (channels, rows, columns)
+        return X.transpose(0, 3, 1, 2).reshape(len(X), -1)
+    if name == 'Dense':
+        return _activations[layer['activation']](np.dot(X, layer['W']) + layer['b'])
+    if name == 'Activation':
+        return _activations[layer['activation']](X)
+    return X
+
+def _expand_layer(layer):
+    # float32 copy of a quantized layer
+    layer = dict(layer)
+    for name in ('kernel', 'W'):
+        if name in layer:
+            weights = layer[name].astype(np.float32)
+            if name + '_scale' in layer:
+                weights *= layer.pop(name + '_scale')
+            layer[name] = weights
+    return layer
+
+def _quantize_layer(layer, weight_dtype):
+    layer = dict(layer)
+    for name in ('kernel', 'W'):
+        if name not in layer:
+            continue
+        if weight_dtype == 'float16':
+            layer[name] = layer[name].astype(np.float16)
+        else:
+            # Symmetric, per output unit int8 scales
+            scale = np.abs(layer[name]).max(axis=0) / 127
+            scale[scale == 0] = 1
+            layer[name] = np.round(layer[name] / scale).astype(np.int8)
+            layer[name + '_scale'] = scale.astype(np.float32)
+    return layer
+
+def _codes(X):
+    # One hot (samples, 1, num_bases, sequence_length) -> base codes, with
+    # all zero columns mapped to num_bases
+    X = np.asarray(X)[:, 0]
+    codes = X.argmax(axis=1).astype(np.uint8)
+    codes[X.max(axis=1) == 0] = X.shape[1]
+    return codes
+
+def _conv(X, kernel, kernel_shape, b):
+    """
+    Valid correlation of channels last X with a (rows * columns * channels,
+    filters) kernel matrix.
+    """
+    num_samples, num_rows, num_columns, num_channels = X.shape
+    kernel_rows, kernel_columns = kernel_shape
+    output_rows, output_columns = num_rows - kernel_rows + 1, num_columns - kernel_columns + 1
+    sample_stride, row_stride, column_stride, channel_stride = X.strides
+    patches = as_strided(
+        X, shape=(num_samples, output_rows, output_columns, kernel_rows, kernel_columns, num_channels),
+        strides=(sample_stride, row_stride, column_stride, row_stride, column_stride, channel_stride),
+        writeable=False)
+    output = np.dot(patches.reshape(-1, kernel.shape[0]), kernel)
+    output += b
+    return output.reshape(num_samples, output_rows, output_columns, -1)
+
+def _max_pool(X, pool_size, strides):
+    num_samples, num_rows, num_columns, num_channels = X.shape
+    output_rows = (num_rows - pool_size[0]) // strides[0] + 1
+    output_columns = (num_columns - pool_size[1]) // strides[1] + 1
+    sample_stride, row_stride, column_stride, channel_stride = X.strides
+    windows = as_strided(
+        X, shape=(num_samples, output_rows, output_columns, pool_size[0], pool_size[1], num_channels),
+        strides=(sample_stride, row_stride * strides[0], column_stride * strides[1],
+                 row_stride, column_stride, channel_stride),
+        writeable=False)
+    return windows.max(axis=(3, 4))
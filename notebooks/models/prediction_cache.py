@@ -0,0 +1,168 @@
+from __future__ import absolute_import, division, print_function
+import glob, hashlib, numpy as np, os
+from collections import Counter, OrderedDict
+
+KEY_DTYPE = np.dtype('S20')
+
+class PredictionCache(object):
+    """
+    Content addressed memo of model predictions, for overlapping tiles and
+    repeated windows that ask the model to score the same sequence many times.
+
+    Each input row is keyed by the SHA-1 of its one hot encoding packed 1 bit per
+    entry (its float32 bytes if it is not 0/1). Predictions are kept in an in
+    memory LRU of at most max_bytes of keys and values. With a directory, new
+    predictions are also saved there every flush_every new predictions and on
+    flush, as a shard of sorted keys (00000.keys.npy) and their predictions
+    (00000.values.npy). Shards are memory mapped and looked up by binary search,
+    so only LRU entries and the predictions not yet saved (flush_every, plus at
+    most one predict call) are held in memory. Use a separate directory for
+    every model, since keys do not identify the model, and clear the cache when
+    the weights change.
+
+    Set as model.prediction_cache to serve model.predict from it; only the rows
+    missing from the cache, each once, are sent to the model in a single call.
+
+    Parameters
+    ----------
+    max_bytes : int
+        memory budget of the LRU. Default: 256 MB.
+    directory : str, optional
+        on disk shard store.
+    """
+
+    def __init__(self, max_bytes=256 << 20, directory=None, flush_every=65536):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.flush_every = flush_every
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.stats = Counter()
+        self._pending = OrderedDict()
+        self._shards = []
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for keys_fname in sorted(glob.glob(os.path.join(directory, '*.keys.npy'))):
+                self._open_shard(keys_fname)
+
+    @staticmethod
+    def keys(X):
+        """
+        Returns the cache key (bytes) of each row of X.
+        """
+        rows = np.asarray(X).reshape(len(X), -1)
+        binary = ((rows == 0) | (rows == 1)).all(axis=1)
+        packed = np.packbits(rows != 0, axis=1)
+        return [hashlib.sha1((b'1' + packed[i].tobytes()) if binary[i] else
+                             (b'f' + rows[i].astype(np.float32).tobytes())).digest()
+                for i in range(len(rows))]
+
+    def predict(self, predict, X):
+        """
+        Returns predict(X), computing only the rows that are not cached.
+        """
+        if not len(X):
+            return np.asarray(predict(X), dtype=np.float32)
+        keys = self.keys(X)
+        values = [self._get(key) for key in keys]
+        if self._shards:
+            self._get_from_shards(keys, values)
+        missing = OrderedDict()
+        for i, (key, value) in enumerate(zip(keys, values)):
+            if value is None:
+                missing.setdefault(key, []).append(i)
+        # repeats of a missing row within X count as hits
+        self.stats['hits'] += len(keys) - len(missing)
+        self.stats['misses'] += len(missing)
+        if missing:
+            first_rows = [rows[0] for rows in missing.values()]
+            predictions = np.asarray(predict(np.asarray(X)[first_rows]), dtype=np.float32)
+            self.stats['model_calls'] += 1
+            for (key, rows), prediction in zip(missing.items(), predictions):
+                self._put(key, prediction)
+                if self.directory is not None:
+                    self._pending[key] = prediction
+                for i in rows:
+                    values[i] = prediction
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+        return np.array(values, dtype=np.float32)
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def flush(self):
+        """
+        Saves predictions made since the last flush to a new shard.
+        """
+        if not self._pending:
+            return
+        keys = np.array(list(self._pending.keys()), dtype=KEY_DTYPE)
+        values = np.array(list(self._pending.values()), dtype=np.float32)
+        order = np.argsort(keys)
+        prefix = os.path.join(self.directory, '{:05d}'.format(
+            len(glob.glob(os.path.join(self.directory, '*.keys.npy')))))
+        # values first, so a shard whose keys exist is complete
+        for suffix, array in (('.values.npy', values[order]), ('.keys.npy', keys[order])):
+            with open(prefix + suffix + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.rename(prefix + suffix + '.tmp', prefix + suffix)
+        self._open_shard(prefix + '.keys.npy')
+        self._pending = OrderedDict()
+
+    def clear(self):
+        """
+        Drops all cached predictions, including the shards on disk, e.g. after
+        the model's weights change.
+        """
+        self.entries.clear()
+        self.nbytes = 0
+        self._pending = OrderedDict()
+        if self.directory is not None:
+            self._shards = []
+            for fname in glob.glob(os.path.join(self.directory, '*.npy')):
+                os.remove(fname)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return '{} entries ({:.1f} MB)\thit rate {:.1%}\t{}'.format(
+            len(self), self.nbytes / (1 << 20), self.hit_rate(),
+            '\t'.join('{}: {}'.format(name, count) for name, count in sorted(self.stats.items())))
+
+    def _get(self, key):
+        value = self.entries.pop(key, None)
+        if value is None:
+            return self._pending.get(key)
+        self.entries[key] = value
+        return value
+
+    def _get_from_shards(self, keys, values):
+        # Looks up the rows missing from memory in every shard at once
+        missing = [i for i, value in enumerate(values) if value is None]
+        for shard_keys, shard_values in self._shards:
+            if not missing or not len(shard_keys):
+                break
+            lookup = np.array([keys[i] for i in missing], dtype=KEY_DTYPE)
+            positions = np.minimum(np.searchsorted(shard_keys, lookup), len(shard_keys) - 1)
+            found = shard_keys[positions] == lookup
+            for i, position in zip(np.array(missing)[found], positions[found]):
+                values[i] = np.array(shard_values[position])
+                self._put(keys[i], values[i])
+                self.stats['disk_hits'] += 1
+            missing = [i for i, is_found in zip(missing, found) if not is_found]
+
+    def _put(self, key, value):
+        self.entries[key] = value
+        self.nbytes += len(key) + value.nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            evicted_key, evicted_value = self.entries.popitem(last=False)
+            self.nbytes -= len(evicted_key) + evicted_value.nbytes
+            self.stats['evictions'] += 1
+
+    def _open_shard(self, keys_fname):
+        values_fname = keys_fname[:-len('.keys.npy')] + '.values.npy'
+        self._shards.append((np.load(keys_fname, mmap_mode='r'), np.load(values_fname, mmap_mode='r')))
@@ -0,0 +1,73 @@
+from __future__ import absolute_import, division, print_function
+import json, numpy as np, socket
+
+DEFAULT_SOCKET = '/tmp/mpra_prediction.sock'
+
+class PredictionError(Exception):
+    pass
+
+class PredictionClient(object):
+    """
+    Client for prediction_server.py. One connection, one request at a time; use a
+    client per thread for concurrent requests.
+
+    Parameters
+    ----------
+    path : str
+        Unix socket of the server. Default: /tmp/mpra_prediction.sock.
+    port : int, optional
+        localhost TCP port of the server, instead of path.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, port=None, timeout=None):
+        if port is not None:
+            self.socket = socket.create_connection(('127.0.0.1', port), timeout)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        self.file = self.socket.makefile('rb')
+        self.task_names = None
+        self._next_id = 0
+
+    def predict(self, seqs):
+        """
+        Returns a (len(seqs), num_tasks) array of predicted activities, in the
+        order of self.task_names.
+        """
+        response = self._request({'sequences': list(seqs)})
+        self.task_names = response['task_names']
+        return np.array(response['predictions'], dtype=np.float32).reshape(
+            len(seqs), len(self.task_names))
+
+    def stats(self):
+        return self._request({'stats': True})['stats']
+
+    def _request(self, request):
+        self._next_id += 1
+        request['id'] = self._next_id
+        self.socket.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        line = self.file.readline()
+        if not line:
+            raise PredictionError("Connection closed by server")
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise PredictionError(response['error'])
+        return response
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def predict(seqs, path=DEFAULT_SOCKET, port=None):
+    """
+    Scores seqs with a running prediction server in a single request.
+    """
+    with PredictionClient(path, port) as client:
+        return client.predict(seqs)
@@ -0,0 +1,230 @@
+"""
+Long running local prediction server. The model is loaded once and concurrent
+requests are gathered into micro-batches, each run in a single inference thread.
+
+Usage: python prediction_server.py <model prefix> [socket path | port] [keras | numpy]
+e.g.   python prediction_server.py models/145_weighted /tmp/mpra_prediction.sock
+
+The protocol is one JSON object per line. A request
+    {"id": 1, "sequences": ["ACGT...", ...]}
+is answered with
+    {"id": 1, "task_names": [...], "predictions": [[...], ...]}
+(one row of per task activities per sequence) or {"id": 1, "error": "..."}.
+{"stats": true} returns request, sequence and batch counts.
+See prediction_client.PredictionClient.
+"""
+from __future__ import absolute_import, division, print_function
+import json, numpy as np, os, socket, sys, threading, time
+from collections import Counter
+try:
+    import queue, socketserver
+except ImportError:
+    import Queue as queue, SocketServer as socketserver
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+DEFAULT_SOCKET = '/tmp/mpra_prediction.sock'
+# Task order of MrpaData.y_multitask
+TASK_NAMES = ['HepG2 SV40P', 'HepG2 minP', 'K562 SV40P', 'K562 minP']
+bases = ['A', 'T', 'C', 'G']
+
+_base_codes = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(bases):
+    _base_codes[ord(_base)] = _base_codes[ord(_base.lower())] = _code
+# As in training, 'N' bases are read as 'A'
+_base_codes[ord('N')] = _base_codes[ord('n')] = 0
+
+def load_model(prefix, engine='keras'):
+    """
+    Loads <prefix>.arch.json / <prefix>.weights.h5 as a SequenceDNN_Regression
+    (engine='keras') or a NumpyModel (engine='numpy').
+    """
+    if engine == 'keras':
+        from models import SequenceDNN_Regression
+        return SequenceDNN_Regression.load(prefix + '.arch.json', prefix + '.weights.h5')
+    elif engine == 'numpy':
+        from numpy_model import NumpyModel
+        return NumpyModel.load(prefix + '.arch.json', prefix + '.weights.h5')
+    raise ValueError("engine must be 'keras' or 'numpy'")
+
+def _input_shape(model):
+    input_shape = getattr(model, 'input_shape', None)
+    if input_shape is None:
+        input_shape = model.model.input_shape[1:]
+    return tuple(input_shape)[-3:]
+
+class MicroBatcher(object):
+    """
+    Gathers concurrent predict calls into batches of up to max_batch_size
+    sequences. A batch is run once it is full or max_latency seconds after its
+    first request arrived; requests arriving while a batch runs join the next.
+    Batches run one at a time in a single inference thread.
+    """
+
+    def __init__(self, predict, max_batch_size=256, max_latency=0.005):
+        self._predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.stats = Counter()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, X):
+        """
+        Returns the predictions for X, run as part of a batch.
+        """
+        request = {'X': X, 'done': threading.Event()}
+        self._queue.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['predictions']
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            pending = [request]
+            size = len(request['X'])
+            deadline = time.time() + self.max_latency
+            while size < self.max_batch_size:
+                timeout = deadline - time.time()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._queue.put(None)
+                    break
+                pending.append(request)
+                size += len(request['X'])
+            self._run_batch(pending)
+
+    def _run_batch(self, pending):
+        self.stats.update(requests=len(pending), batches=1,
+                          sequences=sum(len(request['X']) for request in pending))
+        try:
+            predictions = self._predict(np.concatenate([request['X'] for request in pending]))
+        except Exception as e:
+            for request in pending:
+                request['error'] = e
+                request['done'].set()
+            return
+        start = 0
+        for request in pending:
+            request['predictions'] = predictions[start:start + len(request['X'])]
+            request['done'].set()
+            start += len(request['X'])
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # One thread per connection, answering its JSON lines in order
+
+    def handle(self):
+        prediction_server = self.server.prediction_server
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.error:
+                break
+            if not line:
+                break
+            request = {}
+            try:
+                request = json.loads(line.decode('utf-8'))
+                response = prediction_server.respond(request)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                response = {'id': request.get('id') if isinstance(request, dict) else None,
+                            'error': '{}: {}'.format(type(e).__name__, e)}
+            try:
+                self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            except socket.error:
+                break
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class PredictionServer(object):
+    """
+    Serves model.predict (a SequenceDNN_Regression, Basset or NumpyModel) over a
+    Unix socket or a localhost TCP port, one thread per connection.
+    """
+
+    def __init__(self, model, max_batch_size=256, max_latency=0.005, task_names=None):
+        self.model = model
+        self.num_channels, self.num_bases, self.seq_length = _input_shape(model)
+        self.num_tasks = model.num_tasks
+        self.task_names = task_names or (
+            TASK_NAMES if self.num_tasks == len(TASK_NAMES) else list(map(str, range(self.num_tasks))))
+        self.batcher = MicroBatcher(model.predict, max_batch_size, max_latency)
+
+    def one_hot(self, seqs):
+        """
+        Returns the (N, 1, num_bases, seq_length) float32 encoding of seqs, raising
+        ValueError for sequences of the wrong length or with unknown bases.
+        """
+        if isinstance(seqs, string_types) or not all(isinstance(seq, string_types) for seq in seqs):
+            raise ValueError("sequences must be a list of strings")
+        if any(len(seq) != self.seq_length for seq in seqs):
+            raise ValueError("sequences must be {} bp long".format(self.seq_length))
+        codes = _base_codes[np.frombuffer(u''.join(seqs).encode('ascii', 'replace'), dtype=np.uint8)]
+        if (codes == 255).any():
+            raise ValueError("sequences may only contain A, C, G, T and N")
+        codes = codes.reshape(len(seqs), self.seq_length)
+        return (codes[:, np.newaxis, np.newaxis, :] ==
+                np.arange(self.num_bases)[:, np.newaxis]).astype(np.float32)
+
+    def respond(self, request):
+        if request.get('stats'):
+            return {'id': request.get('id'), 'stats': dict(self.batcher.stats)}
+        X = self.one_hot(request['sequences'])
+        predictions = self.batcher.predict(X) if len(X) else np.zeros((0, self.num_tasks))
+        return {'id': request.get('id'), 'task_names': self.task_names,
+                'predictions': np.asarray(predictions, dtype=np.float64).tolist()}
+
+    def make_server(self, path=DEFAULT_SOCKET, port=None):
+        """
+        Returns the bound SocketServer; call its serve_forever and shutdown.
+        """
+        if port is not None:
+            server = _ThreadingTCPServer(('127.0.0.1', port), _RequestHandler)
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            server = _ThreadingUnixServer(path, _RequestHandler)
+        server.prediction_server = self
+        return server
+
+    def serve_forever(self, path=DEFAULT_SOCKET, port=None):
+        server = self.make_server(path, port)
+        print('Serving {} tasks for {} bp sequences on {}'.format(
+            self.num_tasks, self.seq_length, 'localhost:{}'.format(port) if port is not None else path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.batcher.close()
+
+if __name__ == '__main__':
+    address = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SOCKET
+    engine = sys.argv[3] if len(sys.argv) > 3 else 'keras'
+    server = PredictionServer(load_model(sys.argv[1], engine))
+    if address.isdigit():
+        server.serve_forever(port=int(address))
+    else:
+        server.serve_forever(path=address)
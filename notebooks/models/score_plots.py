@@ -0,0 +1,135 @@
+from __future__ import absolute_import, division, print_function
+import multiprocessing, numpy as np, os, sys
+
+def _plot_sequence_scores(top_axis, bottom_axis, sequence_scores, peak_width, score_name, plot_bases_on_ax):
+    # sequence_scores is num_bases x sequence_length
+    top_axis.cla()
+    bottom_axis.cla()
+    basewise_max_sequence_scores = sequence_scores.max(axis=0)
+    top_axis.plot(range(1, len(basewise_max_sequence_scores) + 1),
+                  basewise_max_sequence_scores)
+    top_axis.set_title('{} scores (motif highlighted)'.format(score_name))
+    peak_position = basewise_max_sequence_scores.argmax()
+    top_axis.axvspan(peak_position - peak_width, peak_position + peak_width,
+                     color='grey', alpha=0.1)
+    peak_sequence_scores = sequence_scores[:, peak_position - peak_width :
+                                              peak_position + peak_width].T
+    # Set non-max letter_heights to zero
+    letter_heights = np.zeros_like(peak_sequence_scores)
+    letter_heights[np.arange(len(letter_heights)),
+                   peak_sequence_scores.argmax(axis=1)] = \
+        basewise_max_sequence_scores[peak_position - peak_width :
+                                     peak_position + peak_width]
+    plot_bases_on_ax(letter_heights, bottom_axis)
+    bottom_axis.set_xticklabels(tuple(map(
+        str, np.arange(peak_position - peak_width, peak_position + peak_width + 1))))
+    bottom_axis.tick_params(axis='x', labelsize='small')
+    bottom_axis.set_xlabel('Position')
+    bottom_axis.set_ylabel('Score')
+
+_renderer = {}
+
+def _pyplot():
+    # Non-interactive pdf backend unless pyplot is already set up, e.g. in a notebook
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        matplotlib.use('pdf')
+    import matplotlib.pyplot as plt
+    return plt
+
+def _init_renderer(scores, output_directory, score_name, peak_width, output_format, sprite_shape):
+    plt = _pyplot()
+    from dragonn.plot import plot_bases_on_ax
+    rows, cols = sprite_shape if output_format == 'sprite' else (1, 1)
+    # One figure per process, reused for every plot it renders
+    figure, axes = plt.subplots(2 * rows, cols, squeeze=False, figsize=(6.4 * cols, 4.8 * rows))
+    _renderer.update(scores=scores, output_directory=output_directory, score_name=score_name,
+                     peak_width=peak_width, output_format=output_format, figure=figure,
+                     axes=axes, plot_bases_on_ax=plot_bases_on_ax)
+
+def _file_name(task_index, sequence_index, num_tasks):
+    return 'sequence_{}{}.png'.format(sequence_index, '_task_{}'.format(task_index) if num_tasks > 1 else '')
+
+def _render(unit):
+    """
+    Renders one unit of work: a task index and a range of sequence indices.
+    """
+    task_index, start, end = unit
+    r = _renderer
+    scores, figure, axes = r['scores'], r['figure'], r['axes']
+    num_tasks = len(scores)
+    draw = lambda top_axis, bottom_axis, sequence_index: _plot_sequence_scores(
+        top_axis, bottom_axis, scores[task_index, sequence_index], r['peak_width'],
+        r['score_name'], r['plot_bases_on_ax'])
+    if r['output_format'] == 'png':
+        for sequence_index in range(start, end):
+            draw(axes[0, 0], axes[1, 0], sequence_index)
+            figure.savefig(os.path.join(r['output_directory'], _file_name(task_index, sequence_index, num_tasks)),
+                           format='png')
+    elif r['output_format'] == 'pdf':
+        from matplotlib.backends.backend_pdf import PdfPages
+        pdf_name = 'sequences_{}_to_{}{}.pdf'.format(
+            start, end - 1, '_task_{}'.format(task_index) if num_tasks > 1 else '')
+        with PdfPages(os.path.join(r['output_directory'], pdf_name)) as pdf:
+            for sequence_index in range(start, end):
+                draw(axes[0, 0], axes[1, 0], sequence_index)
+                pdf.savefig(figure)
+    else:
+        cols = axes.shape[1]
+        for panel in range(axes.size // 2):
+            top_axis, bottom_axis = axes[2 * (panel // cols), panel % cols], axes[2 * (panel // cols) + 1, panel % cols]
+            if start + panel < end:
+                draw(top_axis, bottom_axis, start + panel)
+            else:
+                top_axis.cla()
+                bottom_axis.cla()
+        figure.savefig(os.path.join(r['output_directory'], 'sprite_sequences_{}_to_{}{}.png'.format(
+            start, end - 1, '_task_{}'.format(task_index) if num_tasks > 1 else '')), format='png')
+    return end - start
+
+def render_scores(scores, output_directory, score_name, peak_width=10, output_format='png',
+                  processes=None, chunk_size=64, sprite_shape=(4, 4)):
+    """
+    Renders precomputed per base scores, e.g. from deeplift or in_silico_mutagenesis.
+
+    Parameters
+    ----------
+    scores : np.array
+        (num_task, num_samples, num_bases, sequence_length) score array.
+    output_format : str
+        'png' for one image per (sequence, task) named as before, 'pdf' for one
+        multi-page PDF per task and chunk of chunk_size sequences, or 'sprite' for
+        PNG sheets of sprite_shape (rows, cols) sequences. Default: 'png'.
+    processes : int, optional
+        number of rendering processes, each reusing one figure. Default: all cores.
+    chunk_size : int
+        number of sequences per unit of work. Default: 64.
+
+    Returns
+    -------
+    Number of plots rendered.
+    """
+    try:
+        os.makedirs(output_directory)
+    except OSError:
+        pass
+    if output_format == 'sprite':
+        chunk_size = sprite_shape[0] * sprite_shape[1]
+    num_tasks, num_samples = scores.shape[:2]
+    units = [(task_index, start, min(start + chunk_size, num_samples))
+             for task_index in range(num_tasks) for start in range(0, num_samples, chunk_size)]
+    init_args = (scores, output_directory, score_name, peak_width, output_format, sprite_shape)
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1 or len(units) == 1:
+        plt = _pyplot()
+        _init_renderer(*init_args)
+        try:
+            return sum(map(_render, units))
+        finally:
+            plt.close(_renderer['figure'])
+    pool = multiprocessing.Pool(min(processes, len(units)), _init_renderer, init_args)
+    try:
+        return sum(pool.map(_render, units, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
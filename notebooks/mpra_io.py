@@ -0,0 +1,148 @@
+from __future__ import absolute_import, division, print_function
+import hashlib, json, numpy as np, os
+from functools import wraps
+from numpy.lib.stride_tricks import as_strided
+from warnings import warn
+
+CACHE_DIR = '../data/.cache'
+bases = ['A', 'T', 'C', 'G']
+
+_base_codes = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(bases):
+    _base_codes[ord(_base)] = _base_codes[ord(_base.lower())] = _code
+_base_codes[ord('N')] = _base_codes[ord('n')] = 255
+
+def file_signature(path):
+    """
+    Identifies the current contents of a file by path, size and modification time.
+    """
+    stat = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+def cached(parser):
+    """
+    Caches the arrays returned by parser(path, **kwargs) as an .npz in CACHE_DIR,
+    keyed by the file signature, so each input file is parsed once until it changes.
+    """
+    @wraps(parser)
+    def wrapper(path, **kwargs):
+        key = '{}|{}|{}'.format(parser.__name__, file_signature(path), sorted(kwargs.items()))
+        cache_file = os.path.join(CACHE_DIR, '{}.{}.npz'.format(
+            os.path.basename(path), hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]))
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as arrays:
+                return tuple(arrays['arr_{}'.format(i)] for i in range(len(arrays.files)))
+        result = parser(path, **kwargs)
+        try:
+            if not os.path.isdir(CACHE_DIR):
+                os.makedirs(CACHE_DIR)
+            tmp_file = cache_file + '.tmp.npz'
+            np.savez(tmp_file, *result)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError) as e:
+            warn("Could not cache {}: {}".format(path, e))
+        return result
+    return wrapper
+
+@cached
+def read_table(path, header=False):
+    """
+    Bulk parses a whitespace separated table whose first column is a key.
+    Returns (keys, values) where values is a N x (num_columns - 1) float64 array.
+    """
+    with open(path) as f:
+        if header:
+            f.readline()
+        first = f.readline()
+        num_columns = len(first.split())
+        tokens = np.array((first + f.read()).split()).reshape(-1, num_columns)
+    return tokens[:, 0], tokens[:, 1:].astype(np.float64)
+
+@cached
+def read_sequences(path):
+    """
+    Bulk parses a two column key / sequence file of equal length sequences.
+    Returns (keys, codes) where codes is a N x seq_length uint8 array indexing bases.
+    """
+    with open(path) as f:
+        tokens = f.read().split()
+    keys, seqs = tokens[0::2], tokens[1::2]
+    return np.array(keys), encode(seqs)
+
+def encode(seqs):
+    """
+    Converts equal length sequences to a N x seq_length uint8 array of indices into
+    bases. 'N' bases are replaced with 'A'.
+    """
+    if not len(seqs):
+        return np.zeros((0, 0), dtype=np.uint8)
+    seq_length = len(seqs[0])
+    assert all(len(seq) == seq_length for seq in seqs)
+    codes = _base_codes[np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)]
+    codes = codes.reshape(len(seqs), seq_length)
+    unknown = codes == 255
+    if unknown.any():
+        warn("Replacing 'N' bases with 'A' in {} seqs.".format(unknown.any(axis=1).sum()))
+        codes[unknown] = 0
+    return codes
+
+def decode(codes):
+    """
+    Inverse of encode for a single sequence.
+    """
+    return ''.join(np.array(bases)[codes])
+
+def one_hot(codes, dtype=np.float64):
+    """
+    Returns the (N, 1, num_bases, seq_length) one hot encoding of a code array.
+    """
+    codes = np.asarray(codes)
+    encoded = codes[:, np.newaxis, np.newaxis, :] == np.arange(len(bases))[:, np.newaxis]
+    return encoded.astype(dtype)
+
+def strided_tiles(buffer, tile_length, tile_stride):
+    """
+    Returns a read-only (num_tiles,) + buffer.shape[:-1] + (tile_length,) view of the
+    windows along the last axis of buffer that start every tile_stride positions.
+    Overlapping tiles share memory with buffer instead of being copied.
+    """
+    num_tiles = (buffer.shape[-1] - tile_length) // tile_stride + 1
+    shape = (num_tiles,) + buffer.shape[:-1] + (tile_length,)
+    strides = (buffer.strides[-1] * tile_stride,) + buffer.strides[:-1] + (buffer.strides[-1],)
+    return as_strided(buffer, shape=shape, strides=strides, writeable=False)
+
+class DatasetManifest(object):
+    """
+    Per dataset JSON record, in CACHE_DIR, of values derived from a group of input
+    files (e.g. the valid keys of a design) together with the signatures of those
+    files, so unchanged groups are not recomputed.
+    """
+
+    def __init__(self, name):
+        self.path = os.path.join(CACHE_DIR, '{}.manifest.json'.format(name))
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def get(self, entry, signatures):
+        """
+        Returns the recorded value of entry, or None if its files have changed.
+        """
+        recorded = self.entries.get(entry)
+        if recorded is None or recorded['signatures'] != list(signatures):
+            return None
+        return recorded['value']
+
+    def set(self, entry, signatures, value):
+        self.entries[entry] = {'signatures': list(signatures), 'value': value}
+
+    def save(self):
+        try:
+            if not os.path.isdir(CACHE_DIR):
+                os.makedirs(CACHE_DIR)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.entries, f)
+            os.rename(self.path + '.tmp', self.path)
+        except (IOError, OSError) as e:
+            warn("Could not save {}: {}".format(self.path, e))
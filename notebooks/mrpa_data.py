@@ -1,42 +1,109 @@
-from warnings import warn
-import numpy as np
+import json, numpy as np, os
 from collections import OrderedDict
+from glob import glob
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from barcode_counts import BarcodeCounts
+from mpra_io import DatasetManifest, file_signature, one_hot, decode, read_sequences, read_table
 
-class MrpaData:
+class ExperimentColumn(Mapping):
+    """
+    Read only key -> value mapping over one experiment's column of the
+    MrpaData arrays, for the split_data / data dict interface. Values are
+    (rep1, rep2) tuples for replicate columns and floats for mean columns.
+    """
+
+    def __init__(self, row_keys, key_index, values, measured):
+        self.row_keys = row_keys
+        self.key_index = key_index
+        self.values = values
+        self.measured = measured
+
+    def __getitem__(self, key):
+        i = self.key_index[key]
+        if not self.measured[i]:
+            raise KeyError(key)
+        value = self.values[i]
+        return tuple(value.tolist()) if value.ndim else float(value)
+
+    def __contains__(self, key):
+        i = self.key_index.get(key)
+        return i is not None and bool(self.measured[i])
+
+    def __iter__(self):
+        return (self.row_keys[i] for i in np.flatnonzero(self.measured))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.measured))
+
+class MrpaData(object):
+    """
+    Measurements are held in columns, one row per element measured in any
+    experiment, with the rows of self.valid_keys first and in that order:
+
+        keys            (N,) element keys, and key_index the key -> row mapping
+        replicates      (N, num_experiments, 2) float32 rep1, rep2 values
+        replicate_mask  (N, num_experiments, 2) whether each replicate was measured
+        means           (N, num_experiments) float32 replicate means
+
+    Experiments follow _experiment_keys(). As in the original dict of tuples,
+    rep2 counts as 0 in the mean where only rep1 was measured; values of
+    unmeasured experiments are NaN. split_data and data are OrderedDicts of
+    (cell_type, promoter) -> ExperimentColumn views over these arrays.
+    """
     cell_types =  ['HepG2', 'K562']
     promoters = ['SV40P', 'minP']
     design_names = ['ScaleUpDesign1', 'ScaleUpDesign2']
+    cell_dirs = {'HepG2': 'HEPG2', 'K562': 'K562'}
     bases = ['A', 'T', 'C', 'G']
+    tile_stride = 5
+    tile_length = 145
     
-    def __init__(self):
-        self.split_data = self._load_data()
-        self.data = self._merge_data()
+    def __init__(self, design_names=None):
+        if design_names is not None:
+            self.design_names = design_names
+        self._set_columns(self._load_data())
         self.valid_keys = self._get_valid_keys()
-        self.seqs = self._get_seqs()
+        self._order_rows()
+        self.seq_index, self.seq_codes = self._get_seqs()
         self.one_hot_seqs = self._one_hot_encode_seqs()
         
     def y_multitask(self):
         """
         Returns a N x 4 np.array of experimental data averaged between reps
         Data follows the order given by self.valid keys
-        row 0: cell_type[0], promoters[0]
-        row 1: cell_type[0], promoters[1]
+        column 0: cell_type[0], promoters[0]
+        column 1: cell_type[0], promoters[1]
         ...
+        The array is a read only view of self.means.
         """
-        return np.array([
-                [self.data[experiment_key][key] for key in self.valid_keys]
-                for experiment_key in self._experiment_keys()
-                ]).T
+        return self._read_only(self.means[:len(self.valid_keys)])
+
+    def y_replicates(self):
+        """
+        Returns a N x 4 x 2 read only view of the rep1, rep2 values, in the order
+        of y_multitask.
+        """
+        return self._read_only(self.replicates[:len(self.valid_keys)])
 
     def y_merged_promoters(self):
         """
         Returns a N x 2 np.array of experimental data averaged accross reps and
-        promoters
+        promoters, one column per cell type. Computed once, then a read only view.
         """
-        vector = self.y_multitask()
-        hep_g2 = (vector[0, :] + vector[1, :]) / 2.0
-        k562   = (vector[2, :] + vector[3, :]) / 2.0
-        return np.array([hep_g2, k562]).T
+        if getattr(self, '_merged_promoters', None) is None:
+            self._merged_promoters = self.y_multitask().reshape(
+                -1, len(self.cell_types), len(self.promoters)).mean(axis=2)
+        return self._read_only(self._merged_promoters)
+
+    @property
+    def seqs(self):
+        """
+        Dictionary of key -> sequence, decoded on demand from self.seq_codes.
+        """
+        return {key: decode(self.seq_codes[i]) for key, i in self.seq_index.items()}
 
     def X_one_hot(self):
         return self.one_hot_seqs
@@ -53,72 +120,225 @@ class MrpaData:
         """
         return {key: val for key, val in self.split_data.items()}        
 
+    def element_coords(self):
+        """
+        Returns (chroms, starts, ends) arrays of the hg19 tile coordinates, in the
+        order given by self.valid_keys. Tiles sit tile_stride bp apart inside the
+        regions listed in the coords_<design>_hg19.txt files.
+        """
+        region_coords = self._get_region_coords()
+        chroms, starts = [], []
+        for key in self.valid_keys:
+            parts = key.split('_')
+            chrom, region_start, _ = region_coords['_'.join(parts[:3] + parts[4:])]
+            chroms.append(chrom)
+            starts.append(region_start + self.tile_stride * int(parts[3]))
+        starts = np.array(starts, dtype=np.int64)
+        return np.array(chroms), starts, starts + self.tile_length
+
+    def merge_features(self, keys, features):
+        """
+        Aligns a per-element feature matrix (one row per entry of keys) to
+        self.valid_keys. Returns a N x num_features float32 array; elements
+        without a row are NaN.
+        """
+        features = np.asarray(features, dtype=np.float32).reshape(len(keys), -1)
+        row = {key: i for i, key in enumerate(keys)}
+        merged = np.full((len(self.valid_keys), features.shape[1]), np.nan, dtype=np.float32)
+        found = np.array([key in row for key in self.valid_keys], dtype=bool)
+        merged[found] = features[[row[key] for key in self.valid_keys if key in row]]
+        return merged
+
+    def barcode_counts(self):
+        """
+        Returns an OrderedDict of (cell_type, promoter) -> BarcodeCounts over all designs
+        """
+        return OrderedDict(
+            ((cell_type, promoter), BarcodeCounts.concatenate([
+                BarcodeCounts.from_files(*self._count_files(cell_type, promoter, design_name))
+                for design_name in self.design_names]))
+            for cell_type, promoter in self._experiment_keys())
+
+    def training_weights(self, prior_df=4, quantiles=None):
+        """
+        Returns a N x num_experiments np.array of inverse variance weights estimated
+        from barcode / replicate dispersion, in the order given by self.valid_keys.
+        See BarcodeCounts.variance for the parameters.
+        """
+        return np.hstack([
+                np.nan_to_num(self.merge_features(counts.keys, counts.weights(prior_df, quantiles)))
+                for counts in self.barcode_counts().values()])
+
+    def _count_files(self, cell_type, promoter, design_name):
+        dna_files = ["../data/Scaleup_counts_sequences/DNACOUNTS/{}_{}_Plasmid.counts".format(
+                design_name, promoter)]
+        rna_files = ["../data/Scaleup_counts_sequences/{}/{}_{}_{}_mRNA_Rep{}.counts".format(
+                self.cell_dirs[cell_type], cell_type, design_name, promoter, rep) for rep in (1, 2)]
+        return dna_files, rna_files
+
+    @staticmethod
+    def discover_design_names(directory="../data/Scaleup_counts_sequences"):
+        """
+        Returns the names of all designs with a <design>.sequences.txt file, so that
+        MrpaData(MrpaData.discover_design_names()) picks up newly added designs.
+        """
+        return sorted(os.path.basename(path)[:-len('.sequences.txt')]
+                      for path in glob(os.path.join(directory, '*.sequences.txt')))
+
+    @staticmethod
+    def trained_keys(model_prefix):
+        """
+        Returns the keys a model was trained on, saved by train(..., trained_keys=)
+        as <model_prefix>.keys.json.
+        """
+        with open(model_prefix + '.keys.json') as f:
+            return json.load(f)
+
+    def new_keys(self, model_prefix):
+        """
+        Returns the valid keys that the model saved at model_prefix was not
+        trained on, in self.valid_keys order.
+        """
+        trained_keys = set(self.trained_keys(model_prefix))
+        return [key for key in self.valid_keys if key not in trained_keys]
+
+    def incremental_indices(self, model_prefix, replay_fraction=0.1, random_state=42):
+        """
+        Returns sorted indices into self.valid_keys of all keys new since the model
+        saved at model_prefix was trained, plus a random replay sample of
+        replay_fraction of the old ones, for warm start training from that model
+        (see the warm_start_prefix and trained_keys arguments of train).
+        """
+        trained_keys = set(self.trained_keys(model_prefix))
+        is_new = np.array([key not in trained_keys for key in self.valid_keys], dtype=bool)
+        old = np.flatnonzero(~is_new)
+        replay = np.random.RandomState(random_state).choice(
+            old, int(round(replay_fraction * len(old))), replace=False)
+        return np.sort(np.concatenate([np.flatnonzero(is_new), replay]))
+
     def _experiment_keys(self):
         return [(cell_type, promoter) for cell_type in self.cell_types for promoter in self.promoters]
 
     def _load_data(self):
-        split_data = OrderedDict()
-        for cell_type in self.cell_types:
-            for promoter in self.promoters:
-                experiment_key = (cell_type, promoter)
-                split_data[experiment_key] = {}
-                for design_name in self.design_names:
-                    with open("../data/Scaleup_normalized/{}_{}_{}_mRNA_Rep1.normalized".format(cell_type, design_name, promoter)) as f:
-                        for line in f:
-                            parts = line.strip().split()
-                            key = parts[0]
-                            val = float(parts[1])
-                            if parts[2] == "1":
-                                assert key not in split_data[experiment_key]
-                                split_data[experiment_key][key] = (val, 0)
-
-                    with open("../data/Scaleup_normalized/{}_{}_{}_mRNA_Rep2.normalized".format(cell_type, design_name, promoter)) as f:
-                        for line in f:
-                            parts = line.strip().split()
-                            key = parts[0]
-                            val = float(parts[1])
-                            if parts[2] == "1" and key in split_data[experiment_key]:
-                                assert split_data[experiment_key][key][1] == 0
-                                split_data[experiment_key][key] = (split_data[experiment_key][key][0], val)
-        return split_data
-
-    def _merge_data(self):
-        data = OrderedDict()
-        for experiment_key, key_to_split in self.split_data.items():
-            data[experiment_key] = {}
-            for key, val in key_to_split.items():
-                data[experiment_key][key] = sum(list(self.split_data[experiment_key][key])) / 2.0
-        return data
+        """
+        Returns an OrderedDict of (cell_type, promoter) -> (keys, n x 2 replicate
+        values, n x 2 replicate measured mask) of the elements passing the filter
+        in rep1. Only rep2 values of these elements are kept.
+        """
+        columns = OrderedDict()
+        for cell_type, promoter in self._experiment_keys():
+            experiment_columns = []
+            for design_name in self.design_names:
+                keys1, values1 = read_table("../data/Scaleup_normalized/{}_{}_{}_mRNA_Rep1.normalized".format(cell_type, design_name, promoter))
+                keys2, values2 = read_table("../data/Scaleup_normalized/{}_{}_{}_mRNA_Rep2.normalized".format(cell_type, design_name, promoter))
+                keys1, values1 = keys1[values1[:, 1] == 1], values1[values1[:, 1] == 1, 0]
+                keys2, values2 = keys2[values2[:, 1] == 1], values2[values2[:, 1] == 1, 0]
+                assert len(np.unique(keys1)) == len(keys1) and len(np.unique(keys2)) == len(keys2)
+                _, rows1, rows2 = np.intersect1d(keys1, keys2, assume_unique=True, return_indices=True)
+                values = np.zeros((len(keys1), 2))
+                measured = np.zeros((len(keys1), 2), dtype=bool)
+                values[:, 0], measured[:, 0] = values1, True
+                values[rows1, 1], measured[rows1, 1] = values2[rows2], True
+                experiment_columns.append((keys1, values, measured))
+            keys, values, measured = [np.concatenate(column) for column in zip(*experiment_columns)]
+            assert len(np.unique(keys)) == len(keys)
+            columns[(cell_type, promoter)] = (keys, values, measured)
+        return columns
+
+    def _set_columns(self, columns):
+        """
+        Builds the key index and replicate arrays from the columns of _load_data.
+        """
+        experiment_keys = self._experiment_keys()
+        keys = np.unique(np.concatenate([columns[experiment_key][0] for experiment_key in experiment_keys]))
+        self.replicates = np.full((len(keys), len(experiment_keys), 2), np.nan, dtype=np.float32)
+        self.replicate_mask = np.zeros((len(keys), len(experiment_keys), 2), dtype=bool)
+        for e, experiment_key in enumerate(experiment_keys):
+            experiment_keys_, values, measured = columns[experiment_key]
+            rows = np.searchsorted(keys, experiment_keys_)
+            self.replicates[rows, e] = np.where(measured, values, 0)
+            self.replicate_mask[rows, e] = measured
+        self.keys = keys.astype(str)
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+
+    def _order_rows(self):
+        """
+        Moves the rows of self.valid_keys to the front, in that order, so that
+        y_multitask and X_one_hot rows are slices of the columns, and sets up
+        split_data and data.
+        """
+        valid_rows = np.array([self.key_index[key] for key in self.valid_keys], dtype=np.int64)
+        is_valid = np.zeros(len(self.keys), dtype=bool)
+        is_valid[valid_rows] = True
+        order = np.concatenate([valid_rows, np.flatnonzero(~is_valid)])
+        self.keys = self.keys[order]
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.replicates = self.replicates[order]
+        self.replicate_mask = self.replicate_mask[order]
+        self.means = self.replicates.mean(axis=2)
+        self._merged_promoters = None
+        self.split_data, self.data = OrderedDict(), OrderedDict()
+        for e, experiment_key in enumerate(self._experiment_keys()):
+            measured = self.replicate_mask[:, e, 0]
+            self.split_data[experiment_key] = ExperimentColumn(
+                self.keys, self.key_index, self.replicates[:, e], measured)
+            self.data[experiment_key] = ExperimentColumn(self.keys, self.key_index, self.means[:, e], measured)
+
+    @staticmethod
+    def _read_only(array):
+        view = array.view()
+        view.flags.writeable = False
+        return view
 
     def _get_valid_keys(self):
-        return list(reduce(
-                lambda acc, d: acc.intersection(d.keys()),
-                self.data.values()[1:], 
-                set(self.data.values()[0].keys())
-                ))
+        """
+        Returns the keys measured in every experiment, found design by design;
+        designs whose files are unchanged since the last load reuse the keys
+        recorded in the dataset manifest.
+        """
+        manifest = DatasetManifest(type(self).__name__)
+        measured_everywhere = self.replicate_mask[:, :, 0].all(axis=1)
+        valid_keys = []
+        for design_name in self.design_names:
+            signatures = [file_signature(path) for path in self._design_files(design_name)]
+            keys = manifest.get(design_name, signatures)
+            if keys is None:
+                keys = [str(key) for key in self._design_keys(design_name)
+                        if key in self.key_index and measured_everywhere[self.key_index[key]]]
+                manifest.set(design_name, signatures, keys)
+            valid_keys.extend(keys)
+        manifest.save()
+        return valid_keys
+
+    def _design_keys(self, design_name):
+        return read_sequences("../data/Scaleup_counts_sequences/{}.sequences.txt".format(design_name))[0]
+
+    def _design_files(self, design_name):
+        return ["../data/Scaleup_counts_sequences/{}.sequences.txt".format(design_name)] + [
+                "../data/Scaleup_normalized/{}_{}_{}_mRNA_Rep{}.normalized".format(cell_type, design_name, promoter, rep)
+                for cell_type, promoter in self._experiment_keys() for rep in (1, 2)]
+
+    def _get_region_coords(self):
+        region_coords = {}
+        for design_name in self.design_names:
+            with open("../data/Scaleup_counts_sequences/coords_{}_hg19.txt".format(design_name)) as f:
+                for line in f:
+                    region, chrom, start, end = line.strip().split()
+                    region_coords[region] = (chrom, int(start), int(end))
+        return region_coords
 
     def _get_seqs(self):
-        key_to_seq = {}
-
-        with open("../data/Scaleup_counts_sequences/ScaleUpDesign1.sequences.txt") as f:
-            for line in f:
-                key, seq = line.strip().split()
-                if "N" in seq:
-                    warn("Replacing 'N' bases in seq with 'A' in seq {}.".format(seq))
-                    seq = seq.replace("N", "A")
-                assert key not in key_to_seq
-                key_to_seq[key] = seq
-        
-        with open("../data/Scaleup_counts_sequences/ScaleUpDesign2.sequences.txt") as f:
-            for line in f:
-                key, seq = line.strip().split()
-                if "N" in seq:
-                    warn("Replacing 'N' bases in seq with 'A' in seq {}.".format(seq))
-                    seq = seq.replace("N", "A")
-                assert key not in key_to_seq
-                key_to_seq[key] = seq
-        return key_to_seq
-    
+        """
+        Returns (key -> row index, uint8 base code array) over all design sequences.
+        """
+        keys, codes = zip(*[
+                read_sequences("../data/Scaleup_counts_sequences/{}.sequences.txt".format(design_name))
+                for design_name in self.design_names])
+        keys = np.concatenate(keys)
+        seq_index = {key: i for i, key in enumerate(keys)}
+        assert len(seq_index) == len(keys)
+        return seq_index, np.concatenate(codes)
+
     def _one_hot_encode_seq(self, seq):
         result = np.zeros((len(self.bases), len(seq)))
         for i, base in enumerate(seq):
@@ -127,5 +347,4 @@ class MrpaData:
         return result
 
     def _one_hot_encode_seqs(self):
-        shape = (len(self.valid_keys), 1, len(self.bases), len(self.seqs.values()[0]))
-        return np.concatenate([self._one_hot_encode_seq(self.seqs[key]) for key in self.valid_keys]).reshape(*shape)
+        return one_hot(self.seq_codes[[self.seq_index[key] for key in self.valid_keys]])
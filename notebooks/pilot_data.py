@@ -0,0 +1,150 @@
+import numpy as np
+from collections import OrderedDict
+from numpy.lib.stride_tricks import as_strided
+from mrpa_data import MrpaData
+from mpra_io import one_hot, read_sequences, read_table, strided_tiles
+
+class PilotData(MrpaData):
+    """
+    Pilot design data: regions tiled by 145-bp sequences spaced 30 bp apart, with
+    keys of the form GROUP_REGIONIDINGROUP_TILEPOS (e.g. high_0_3).
+
+    Each region's sequence is stored once. Tiles are strided views into a single
+    buffer holding all regions padded to a multiple of tile_stride, so overlapping
+    tiles are neither duplicated nor encoded more than once.
+    """
+    promoters = ['SV40P']
+    design_names = ['PilotDesign']
+    tile_stride = 30
+
+    def __init__(self):
+        self.region_keys, self.region_codes = self._get_regions()
+        MrpaData.__init__(self)
+        self.region_tiles = self._get_region_tiles()
+
+    def y_merged_promoters(self):
+        """
+        There is a single promoter in the pilot, so this is y_multitask.
+        """
+        return self.y_multitask()
+
+    def tile_view(self):
+        """
+        Returns a (num_regions, tiles_per_region, 1, num_bases, tile_length) read-only
+        view of the one hot encoded tiles, sharing memory between overlapping tiles.
+        """
+        buffer = self._one_hot_buffer()
+        step = buffer.strides[-1] * self.tile_stride
+        return as_strided(
+            buffer, writeable=False,
+            shape=(len(self.region_keys), self._tiles_per_region()) + buffer.shape[:-1] + (self.tile_length,),
+            strides=(step * self._slots_per_region(), step) + buffer.strides)
+
+    def element_coords(self):
+        """
+        Returns (chroms, starts, ends) arrays of the hg19 tile coordinates, in the
+        order given by self.valid_keys.
+        """
+        key_to_coords = {}
+        with open("../data/Pilot_counts_sequences/coords_PilotDesign_hg19.txt") as f:
+            for line in f:
+                key, chrom, start, end = line.strip().split()
+                key_to_coords[key] = (chrom, int(start), int(end))
+        chroms, starts, ends = zip(*[key_to_coords[key] for key in self.valid_keys])
+        return np.array(chroms), np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+    def _tiles_per_region(self):
+        return (self.region_codes.shape[1] - self.tile_length) // self.tile_stride + 1
+
+    def _slots_per_region(self):
+        return -(-self.region_codes.shape[1] // self.tile_stride)
+
+    def _get_regions(self):
+        """
+        Returns (region keys, num_regions x region_length uint8 codes), reassembled
+        from the overlapping tiles of each region.
+        """
+        keys, codes = read_sequences("../data/Pilot_counts_sequences/PilotDesign.sequences.txt")
+        regions = [key.rsplit('_', 1) for key in keys]
+        region_keys = list(OrderedDict.fromkeys(region for region, _ in regions))
+        tiles_per_region = len(keys) // len(region_keys)
+        assert [int(tile) for _, tile in regions] == list(range(tiles_per_region)) * len(region_keys)
+        codes = codes.reshape(len(region_keys), tiles_per_region, -1)
+        region_codes = np.concatenate(
+            [codes[:, 0], codes[:, 1:, -self.tile_stride:].reshape(len(region_keys), -1)], axis=1)
+        for tile in range(tiles_per_region):
+            start = tile * self.tile_stride
+            assert (region_codes[:, start:start + codes.shape[2]] == codes[:, tile]).all()
+        return region_keys, region_codes
+
+    def _padded_codes(self):
+        # Regions laid end to end, each padded to _slots_per_region() * tile_stride
+        # bases, so that a single stride walks over the tiles of every region.
+        padded = np.zeros((len(self.region_keys), self._slots_per_region() * self.tile_stride),
+                          dtype=np.uint8)
+        padded[:, :self.region_codes.shape[1]] = self.region_codes
+        return padded.ravel()
+
+    def _one_hot_buffer(self):
+        if getattr(self, '_one_hot_regions', None) is None:
+            self._one_hot_regions = one_hot(self._padded_codes()[np.newaxis])[0]
+        return self._one_hot_regions
+
+    def _load_data(self):
+        columns = OrderedDict()
+        for cell_type, promoter in self._experiment_keys():
+            reps = [read_table("../data/Pilot_normalized/{}/tablenorm_recenterends_{}_Rep{}_20.txt".format(
+                        self.cell_dirs[cell_type], cell_type, rep)) for rep in (1, 2)]
+            (keys1, values1), (keys2, values2) = reps
+            assert (keys1 == keys2).all()
+            keys = np.array(['{}_{}'.format(region, tile)
+                             for region in keys1 for tile in range(values1.shape[1])])
+            values = np.stack([values1.ravel(), values2.ravel()], axis=1)
+            columns[(cell_type, promoter)] = (keys, values, np.ones(values.shape, dtype=bool))
+        return columns
+
+    def _count_files(self, cell_type, promoter, design_name):
+        dna_files = ["../data/Pilot_counts_sequences/DNACOUNTS/{}_{}_Plasmid_Rep{}.counts".format(
+                design_name, promoter, rep) for rep in (1, 2)]
+        rna_files = ["../data/Pilot_counts_sequences/{}/{}_{}_{}_mRNA_Rep{}.counts".format(
+                self.cell_dirs[cell_type], cell_type, design_name, promoter, rep) for rep in (1, 2)]
+        return dna_files, rna_files
+
+    def _design_keys(self, design_name):
+        # Design order, so tiles of a region stay adjacent.
+        return self._tile_keys()
+
+    def _design_files(self, design_name):
+        return ["../data/Pilot_counts_sequences/{}.sequences.txt".format(design_name)] + [
+                "../data/Pilot_normalized/{}/tablenorm_recenterends_{}_Rep{}_20.txt".format(
+                    self.cell_dirs[cell_type], cell_type, rep)
+                for cell_type in self.cell_types for rep in (1, 2)]
+
+    def _tile_keys(self):
+        return ['{}_{}'.format(region, tile) for region in self.region_keys
+                for tile in range(self._tiles_per_region())]
+
+    def _get_seqs(self):
+        """
+        Returns (key -> row index, strided tile code view). Row r * slots + t of the
+        view is tile t of region r.
+        """
+        slots = self._slots_per_region()
+        seq_index = {'{}_{}'.format(region, tile): r * slots + tile
+                     for r, region in enumerate(self.region_keys)
+                     for tile in range(self._tiles_per_region())}
+        return seq_index, strided_tiles(self._padded_codes(), self.tile_length, self.tile_stride)
+
+    def _one_hot_encode_seqs(self):
+        tiles = strided_tiles(self._one_hot_buffer(), self.tile_length, self.tile_stride)
+        return tiles[[self.seq_index[key] for key in self.valid_keys]]
+
+    def _get_region_tiles(self):
+        """
+        Returns a num_regions x tiles_per_region array of row indices into
+        self.valid_keys (and X_one_hot / y_multitask), -1 for unmeasured tiles.
+        """
+        row = {key: i for i, key in enumerate(self.valid_keys)}
+        return np.array([[row.get('{}_{}'.format(region, tile), -1)
+                          for tile in range(self._tiles_per_region())]
+                         for region in self.region_keys], dtype=np.int64)